@@ -1,11 +1,67 @@
+import importlib
+import sys
+import types
+
 from .angrymetalpy import *
-from .timing import *
 
-__all__ = ['site_score_mapping', 'Review', 'Reviewer', 'reviews_from_txt', \
-           'reviewers_from_reviews', 'months_between', 'date_range']
+# Everything outside the core review classes is imported on first use, so
+# that importing the package stays fast and does not load NumPy, SciPy or
+# matplotlib for programs that never need them
+_lazy_names = {
+    'months_between': 'timing', 'date_range': 'timing',
+    'month_index': 'timing', 'bucket': 'timing',
+    'ReviewTable': 'table', 'TagIndex': 'index', 'DateIndex': 'index',
+    'Query': 'query', 'ReviewCube': 'cube',
+    'monthly_series': 'series', 'fit_linear_trends': 'series',
+    'trend_values': 'series', 'autocorrelation': 'series',
+    'tag_incidence': 'tags', 'tag_cooccurrence': 'tags',
+    'load_reviews': 'cache',
+    'read_reviews_parallel': 'parallel', 'read_table_parallel': 'parallel',
+    'set_month_axis': 'plotting',
+}
+
+__all__ = ['site_score_mapping', 'Review', 'Reviewer', 'reviews_from_json', \
+           'iter_reviews_json', 'reviews_from_dicts', 'reviews_from_csv', \
+           'write_reviews', 'read_reviews', \
+           'ReviewerRegistry', 'reviewers_from_reviews', 'months_between', 'date_range', \
+           'month_index', 'bucket', \
+           'ReviewTable', 'TagIndex', 'DateIndex', 'Query', 'ReviewCube', \
+           'tag_incidence', 'tag_cooccurrence', \
+           'monthly_series', 'fit_linear_trends', 'trend_values', 'autocorrelation', \
+           'load_reviews', 'read_reviews_parallel', 'read_table_parallel', \
+           'set_month_axis']
+
+
+def __getattr__(name):
+    """ Import the submodule providing name on first access (PEP 562) """
+    try:
+        module_name = _lazy_names[name]
+    except KeyError:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    value = getattr(importlib.import_module('.' + module_name, __name__), name)
+    setattr(sys.modules[__name__], name, value)
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_names))
+
+
+if sys.version_info < (3, 7):
+    # Module level __getattr__ is only used by Python 3.7 and later. Before
+    # that, the package module is replaced by one whose class forwards to it.
+    _module_getattr = __getattr__
+    _module_dir = __dir__
+
+    class _LazyModule(types.ModuleType):
+        def __getattr__(self, name):
+            return _module_getattr(name)
+
+        def __dir__(self):
+            return _module_dir()
 
-try:
-    import matplotlib.pyplot
-    __all__.append('set_month_axis')
-except ImportError:
-    print("Matplotlib not found. Some plotting functions will not be available")
+    _lazy_module = _LazyModule(__name__, __doc__)
+    _lazy_module.__dict__.update(globals())
+    # the functions above use the globals of this module, which Python 2
+    # clears when the module is freed, so keep it alive
+    _lazy_module._module = sys.modules[__name__]
+    sys.modules[__name__] = _lazy_module
@@ -1,7 +1,10 @@
 import json
 import datetime as dt
-import numpy as np
 import csv
+import re
+import threading
+from collections import Counter
+from json.scanner import py_make_scanner
 from StringIO import StringIO
 
 # These are the interpretation of the scores listed on the site
@@ -29,25 +32,94 @@ class _SetEncoder(json.JSONEncoder):
        return json.JSONEncoder.default(self, obj)
 
 
+# Author and artist strings repeat across many reviews, so each distinct
+# value is kept once here and shared by all reviews using it. Both are utf-8
+# byte strings, and each field has its own table so that a value is never
+# looked up against a unicode tag of the same name.
+_artists = {}
+_authors = {}
+
+def _intern(strings, string):
+    return strings.setdefault(string, string)
+
+def _unicode(string):
+    if isinstance(string, str):
+        return string.decode('utf-8')
+    return string
+
+# Reviews store their tags as ids into this shared tag vocabulary. Tags are
+# unicode, as when read from JSON, whatever form they are given in.
+_tag_names = []
+_tag_ids = {}
+_tag_lock = threading.Lock()
+
+def _tag_id(tag):
+    tag = _unicode(tag)
+    try:
+        return _tag_ids[tag]
+    except KeyError:
+        with _tag_lock:
+            if tag not in _tag_ids:
+                _tag_ids[tag] = len(_tag_names)
+                _tag_names.append(tag)
+            return _tag_ids[tag]
+
+# Tags dropped when creating reviews: numbers, generic tags and dates of the
+# form e.g. Mar2016 or Mar16
+_dropped_tag = re.compile(r"""
+    \s*[-+]?(\d+\.?\d*(e[-+]?\d+)?|\.\d+(e[-+]?\d+)?|nan|inf|infinity)\s*\Z
+    | (reviews?|releases?)\Z
+    | (jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)(\d{2}|\d{4})\Z
+    """, re.IGNORECASE | re.VERBOSE)
+
+# Maps raw tags to their id, or None if the tag is dropped. Tags repeat
+# heavily across reviews so each is only classified once. The cache is
+# bounded and simply cleared when full.
+_tag_cache = {}
+_TAG_CACHE_SIZE = 1 << 16
+
+def _filtered_tag_id(tag):
+    tag = _unicode(tag)
+    try:
+        return _tag_cache[tag]
+    except KeyError:
+        pass
+    tag_id = None if _dropped_tag.match(tag) else _tag_id(tag)
+    if len(_tag_cache) >= _TAG_CACHE_SIZE:
+        _tag_cache.clear()
+    _tag_cache[tag] = tag_id
+    return tag_id
+
+
 class Review(object):
+    __slots__ = ('_album', '_artist', '_author', '_date', '_tag_ids',
+                 '_score', '_text')
+
     def __init__(self, album, artist, author, date, tags, score, text):
          # found that some albums have an extra ending
         self._album = album.split(' | Angry Metal Guy')[0].strip()
-        self._artist = artist
-        self._author = author
+        self._artist = _intern(_artists, artist)
+        self._author = _intern(_authors, author)
         self._date = date
-        self._tags = tags
         self._score = score
 
-        # some reviews are unscored, so we set a flag
-        if self._score == -1:
-            self._scored = False
-        else:
-            self._scored = True
+        # text may be a callable returning the text, so it is only loaded
+        # when needed. Empty text is not stored.
+        self._text = text if text != '' else None
+
+        self._tag_ids = self._filter_tags(tags)
 
-        self._text = text
+    def __getstate__(self):
+        # tag ids are only meaningful within one process, so pickle names
+        return (self._album, self._artist, self._author, self._date,
+                list(self.tags), self._score, self._text)
 
-        self._filter_tags()
+    def __setstate__(self, state):
+        album, artist, author, self._date, tags, self._score, self._text = state
+        self._album = album
+        self._artist = _intern(_artists, artist)
+        self._author = _intern(_authors, author)
+        self._tag_ids = tuple(sorted(set(_tag_id(_) for _ in tags)))
 
     def __repr__(self):
         return 'Review of {} by {}. Reviewer: {} on {}. Score: {}'.format(
@@ -61,41 +133,16 @@ class Review(object):
                 self._author != "" and self._date is not None and \
                 self._score != -1
 
-    def _filter_tags(self):
+    @staticmethod
+    def _filter_tags(tags):
         """
-        Remove numbers and dates from tag list. Private method because
-        this should be done while creating the review object
+        Remove numbers and dates from tag list and return the ids of the
+        remaining tags. Private method because this should be done while
+        creating the review object
         """
-        newtags = set()
-        for tag in self._tags:
-            # see if the tag is a number
-            try:
-                tag = float(tag)
-                continue
-            except ValueError:
-                pass
-
-            # cut out generic tags
-            if tag.lower() == "review" or tag.lower() == "reviews":
-                continue
-            if tag.lower() == "release" or tag.lower() == "releases":
-                continue
-
-            # cut out tags of the form e.g. Mar2016 or Mar16
-            try:
-                dt.datetime.strptime(tag, "%b%y")
-                continue
-            except ValueError:
-                pass
-            try:
-                dt.datetime.strptime(tag, "%b%Y")
-                continue
-            except ValueError:
-                pass
-
-            newtags.add(tag)
-
-        self._tags = newtags
+        tag_ids = set(_filtered_tag_id(tag) for tag in tags)
+        tag_ids.discard(None)
+        return tuple(sorted(tag_ids))
 
     def json(self):
         json_dict = {
@@ -103,7 +150,7 @@ class Review(object):
             'artist': self._artist,
             'author': self._author,
             'date': dt.datetime.strftime(self._date, "%Y-%m-%d"),
-            'tags': self._tags,
+            'tags': self.tags,
             'score': self._score,
         }
         return json.dumps(json_dict, cls=_SetEncoder, indent=4, sort_keys=True)
@@ -116,7 +163,7 @@ class Review(object):
 		esc_string =  esc_string.decode('utf-8')
 	    return esc_string
 
-        tag_string = escape(';'.join(self._tags))
+        tag_string = escape(';'.join(self.tags))
         csv_fields = [
             escape(self._album), escape(self._artist), 
             escape(self._author), 
@@ -144,7 +191,21 @@ class Review(object):
 
     @property
     def tags(self):
-        return self._tags
+        return set(_tag_names[_] for _ in self._tag_ids)
+
+    @property
+    def scored(self):
+        """ Some reviews are unscored, these have a score of -1 """
+        return self._score != -1
+
+    @property
+    def text(self):
+        """ Text of the review, loaded on access if given as a callable """
+        if self._text is None:
+            return ''
+        if callable(self._text):
+            return self._text()
+        return self._text
 
     @author.setter
     def author(self, val):
@@ -159,6 +220,14 @@ class Review(object):
         """ Create a review object from a JSON string """
         try:
             json_dict = json.loads(string)
+        except Exception as e:
+            raise ValueError
+        return Review.from_dict(json_dict)
+
+    @staticmethod
+    def from_dict(json_dict):
+        """ Create a review object from an already decoded JSON dict """
+        try:
             rev = Review(json_dict['album'].encode('utf-8'),
                          json_dict['artist'].encode('utf-8'),
                          json_dict['author'].encode('utf-8'),
@@ -208,9 +277,24 @@ class Review(object):
 
 
 class Reviewer(object):
+    # NumPy is imported by the methods using it, so that reading and writing
+    # reviews does not load it
     def __init__(self, name):
+        import numpy as np
         self._name = name
         self._reviews = set()
+        # number of reviews whose author field was overwritten
+        self._author_overwrites = 0
+
+        # aggregates kept up to date as reviews are added. Unscored reviews
+        # count for tags but are left out of the score aggregates.
+        self._tag_counts = Counter()
+        self._scores = []
+        self._score_hist = np.zeros(11, dtype=int) # always [0, 5.0] in 0.5 steps
+        self._score_sum = 0.
+        self._score_sumsq = 0.
+        self._score_min = None
+        self._score_max = None
 
     @property
     def name(self):
@@ -220,97 +304,400 @@ class Reviewer(object):
     def reviews(self):
         return self._reviews
 
-    def add_review(self, review):
-        """ Associate a review with this reviewer """
+    @property
+    def author_overwrites(self):
+        return self._author_overwrites
+
+    def _claim(self, review):
+        """ Take ownership of a review, returning False if already owned """
+        if review in self._reviews:
+            return False
         if review.author != '' and review.author != self._name:
-            print('Warning: Overwriting review author field.')
+            self._author_overwrites += 1
         review.author = self._name
         self._reviews.add(review)
+        self._tag_counts.update(review.tags)
+        return True
 
-    def tag_list(self):
-        tagset = set()
-        for review in self._reviews:
-            for tag in review.tags:
-                tagset.add(tag)
-
-        return list(tagset)
+    def add_review(self, review):
+        """ Associate a review with this reviewer """
+        if not self._claim(review) or not review.scored:
+            return
+
+        score = review.score
+        self._scores.append(score)
+        self._score_hist[int(score * 2)] += 1
+        self._score_sum += score
+        self._score_sumsq += score * score
+        if self._score_min is None or score < self._score_min:
+            self._score_min = score
+        if self._score_max is None or score > self._score_max:
+            self._score_max = score
+
+    def add_reviews(self, reviews):
+        """ Associate many reviews with this reviewer at once """
+        new_scores = [rev.score for rev in reviews
+                      if self._claim(rev) and rev.scored]
+        if len(new_scores) == 0:
+            return
+
+        import numpy as np
+        scores = np.asarray(new_scores, dtype=float)
+        self._scores.extend(new_scores)
+        self._score_hist += np.bincount((scores * 2).astype(int), minlength=11)
+        self._score_sum += scores.sum()
+        self._score_sumsq += np.dot(scores, scores)
+        lo, hi = scores.min(), scores.max()
+        self._score_min = lo if self._score_min is None else min(lo, self._score_min)
+        self._score_max = hi if self._score_max is None else max(hi, self._score_max)
 
-    def tag_counts(self, sort='a'):
-        the_tags = self.tag_list()
-        tag_counts = np.zeros(len(the_tags), dtype=int)
+    def tag_list(self):
+        return list(self._tag_counts)
 
-        for review in self._reviews:
-            for tag in review.tags:
-                tag_counts[the_tags.index(tag)] += 1
+    def tag_counts(self, sort='a', top_k=None):
+        """ List of (tag, count) pairs. If top_k is given only the k most
+            used tags are returned """
+        if top_k is None:
+            counts = self._tag_counts.items()
+        else:
+            counts = self._tag_counts.most_common(top_k)
 
         # user may pass 'a' or 'd' to sort ascending or descending
         rev = True if sort == 'd' else False
-        return sorted(zip(the_tags, tag_counts), key=lambda x: x[1], reverse=rev)
+        return sorted(counts, key=lambda x: x[1], reverse=rev)
 
     def score_list(self):
-        scorelist = []
-        for review in self._reviews:
-            scorelist.append(review.score)
-
-        return np.asarray(scorelist)
+        import numpy as np
+        return np.asarray(self._scores)
 
     def score_counts(self):
-        scorehist = np.zeros(11) # always [0, 5.0] in 0.5 steps
-        for review in self._reviews:
-            scorehist[int(review.score * 2)] += 1
+        return self._score_hist.astype(float)
+
+    def score_mean(self):
+        import numpy as np
+        n = len(self._scores)
+        return self._score_sum / n if n > 0 else np.nan
+
+    def score_std(self):
+        """ Population standard deviation of the scores """
+        import numpy as np
+        n = len(self._scores)
+        if n == 0:
+            return np.nan
+        var = self._score_sumsq / n - (self._score_sum / n) ** 2
+        return np.sqrt(max(var, 0.))
+
+    def score_range(self):
+        """ Lowest and highest score given by this reviewer """
+        return (self._score_min, self._score_max)
+
+
+def _cached_date(dates, string):
+    """ Parse a YYYY-MM-DD date, reusing the results kept in dates """
+    try:
+        return dates[string]
+    except KeyError:
+        pass
+    # much faster than strptime, which this is called for a lot
+    if len(string) != 10 or string[4] != '-' or string[7] != '-':
+        raise ValueError('Bad date {!r}'.format(string))
+    date = dates[string] = dt.datetime(int(string[:4]), int(string[5:7]),
+                                       int(string[8:]))
+    return date
+
+def reviews_from_dicts(json_dicts):
+    """ Return a list of reviews from a batch of decoded JSON dicts, skipping
+        invalid and unscored records. The tag filter and date parsing are
+        shared across the batch, so each distinct tag or date is handled
+        only once. """
+    tag_ids = {}
+    dates = {}
+    reviews = []
+    for json_dict in json_dicts:
+        try:
+            ids = set()
+            for tag in json_dict['tags']:
+                try:
+                    ids.add(tag_ids[tag])
+                except KeyError:
+                    tag_ids[tag] = _filtered_tag_id(tag)
+                    ids.add(tag_ids[tag])
+            ids.discard(None)
 
-        return scorehist
+            rev = Review(json_dict['album'].encode('utf-8'),
+                         json_dict['artist'].encode('utf-8'),
+                         json_dict['author'].encode('utf-8'),
+                         _cached_date(dates, json_dict['date']),
+                         (), json_dict['score'], '')
+            rev._tag_ids = tuple(sorted(ids))
+        except (AttributeError, KeyError, TypeError, ValueError):
+            continue
+        if rev.is_valid():
+            # filter out unscored reviews
+            reviews.append(rev)
 
+    return reviews
 
-def reviews_from_json(fname):
-    """ Return a list of reviews from a text file containing JSON dumps of review objects """
-    reviews = []
+_json_error_char = re.compile(r'\(char (\d+)')
+
+def _json_error_pos(decoder, buf, pos):
+    """ Position in buf at which the JSON value at pos fails to decode. The
+        C decoder does not say where a nested value failed, so the value is
+        decoded again by the pure Python one, whose errors give it. Errors
+        without a position, such as a string cut at its opening quote, are
+        taken to be at the end of buf. """
+    try:
+        py_make_scanner(decoder)(buf, pos)
+    except StopIteration:
+        return pos
+    except ValueError as e:
+        match = _json_error_char.search(str(e))
+        if match:
+            return int(match.group(1))
+    return len(buf)
+
+def iter_reviews_json(fname, chunk_size=1 << 16):
+    """ Lazily yield reviews from a text file containing JSON dumps of review
+        objects. Each complete value is decoded once by an incremental decoder
+        reading fixed size chunks, so memory use does not grow with the file.
+        A value that fails to decode on a line already read in full is bad
+        and raises a ValueError right away. """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+    batch = []
     with open(fname, 'r') as f:
-        for line in f:
-            # skip header
-            if line[0] == '#':
-                continue
-            while True:
-                try:
-                    rev = Review.from_json(line)
-                    if rev.is_valid():
-                        # filter out unscored reviews
-                        reviews.append(rev)
+        while True:
+            # skip whitespace and header lines between values
+            while pos < len(buf):
+                if buf[pos].isspace():
+                    pos += 1
+                elif buf[pos] == '#':
+                    end = buf.find('\n', pos)
+                    if end == -1:
+                        # a header line at the end of the file is complete
+                        pos = len(buf) if eof else pos
+                        break
+                    pos = end + 1
+                else:
                     break
-                except ValueError:
-                    # Not yet a complete JSON value
-                    line += next(f)
 
-    return reviews
+            try:
+                if pos == len(buf) or buf[pos] == '#':
+                    raise ValueError
+                json_dict, pos = decoder.raw_decode(buf, pos)
+                batch.append(json_dict)
+            except ValueError as e:
+                if pos < len(buf) and buf[pos] != '#' and \
+                        buf.find('\n', _json_error_pos(decoder, buf, pos)) != -1:
+                    # more data cannot fix an error before the end of a line
+                    raise ValueError('Bad JSON value in {}: {}'.format(fname, e))
+
+                # the values decoded from this chunk are built as one batch
+                for rev in reviews_from_dicts(batch):
+                    yield rev
+                batch = []
+
+                # Not yet a complete JSON value, read another chunk
+                if eof:
+                    if buf[pos:].strip() != '':
+                        raise ValueError('Truncated JSON value in {}'.format(fname))
+                    return
+                chunk = f.read(chunk_size)
+                eof = chunk == ''
+                buf = buf[pos:] + chunk
+                pos = 0
+
+def reviews_from_json(fname):
+    """ Return a list of reviews from a text file containing JSON dumps of review objects """
+    return list(iter_reviews_json(fname))
 
 def reviews_from_csv(fname):
     """ Return a list of reviews from a text file containing csv-style review info """
+    return read_reviews(fname, fmt='csv')
+
+def _utf8(string):
+    if isinstance(string, unicode):
+        return string.encode('utf-8')
+    return string
+
+class _Utf8Memo(dict):
+    """ utf-8 encodings of repeated strings, each encoded once """
+    def __missing__(self, string):
+        encoded = self[string] = _utf8(string)
+        return encoded
+
+def _write_csv(f, reviews):
+    writer = csv.writer(f, quoting=csv.QUOTE_NONNUMERIC)
+    dates = {}
+    utf8 = _Utf8Memo()
+    tag_utf8 = _Utf8Memo() # tags are unicode, artists and authors bytes
+    count = 0
+    for rev in reviews:
+        try:
+            date = dates[rev._date]
+        except KeyError:
+            date = dates[rev._date] = rev._date.date().isoformat()
+        writer.writerow((
+            _utf8(rev._album), utf8[rev._artist], utf8[rev._author], date,
+            ';'.join([tag_utf8[_tag_names[_]] for _ in rev._tag_ids]),
+            float(rev._score)))
+        count += 1
+    return count
+
+def _write_jsonl(f, reviews):
+    encoder = json.JSONEncoder(separators=(',', ':'), sort_keys=True)
+    dates = {}
+    count = 0
+    for rev in reviews:
+        try:
+            date = dates[rev._date]
+        except KeyError:
+            date = dates[rev._date] = rev._date.date().isoformat()
+        f.write(encoder.encode({
+            'album': rev._album,
+            'artist': rev._artist,
+            'author': rev._author,
+            'date': date,
+            'tags': [_tag_names[_] for _ in rev._tag_ids],
+            'score': rev._score,
+        }))
+        f.write('\n')
+        count += 1
+    return count
+
+def _read_csv(f, fname):
+    """ Valid reviews from the rows of a CSV file read with one reader """
+    tag_ids = {}
+    dates = {}
     reviews = []
-    with open(fname, 'r') as f:
-        for line in f:
-            #try:
-            rev = Review.from_csv(line)
-            if rev.is_valid():
-                reviews.append(rev)
-            #except ValueError:
-            #    pass
-
+    reader = csv.reader(f)
+    for row in reader:
+        if not row:
+            continue
+        try:
+            album, artist, author, date, tags, score = row
+            date = _cached_date(dates, date)
+            score = float(score)
+        except ValueError:
+            raise ValueError('Bad review on line {} of {}'.format(
+                reader.line_num, fname))
+
+        ids = set()
+        for tag in tags.split(';') if tags else ():
+            try:
+                ids.add(tag_ids[tag])
+            except KeyError:
+                # tags are unicode, as when read from JSON
+                tag_ids[tag] = _filtered_tag_id(tag.decode('utf-8'))
+                ids.add(tag_ids[tag])
+        ids.discard(None)
+
+        rev = Review(album, artist, author, date, (), score, '')
+        rev._tag_ids = tuple(sorted(ids))
+        if rev.is_valid():
+            reviews.append(rev)
     return reviews
 
-def reviewers_from_reviews(rev_list):
-    """ Returns a list of reviewers inferred from the author field of
-        each review in a review list """
-    amg_reviewers = []
-    for rev in rev_list:
-        if rev.score == -1 or rev._album == '':
-            continue
+def _read_jsonl(f, fname):
+    """ Valid reviews from a file with one JSON dict per line. Blank lines
+        and header lines starting with # are skipped. """
+    decoder = json.JSONDecoder()
+
+    def json_dicts():
+        for line_num, line in enumerate(f, 1):
+            if line.isspace() or line.startswith('#'):
+                continue
+            try:
+                yield decoder.decode(line)
+            except ValueError:
+                raise ValueError('Bad JSON on line {} of {}'.format(line_num, fname))
+
+    return reviews_from_dicts(json_dicts())
+
+def write_reviews(fname, reviews, fmt='csv'):
+    """
+    Write reviews to a file in one pass, as CSV rows like those of
+    Review.csv() (fmt='csv') or as one compact JSON dict per line
+    (fmt='jsonl'). Returns the number of reviews written.
+    """
+    if fmt == 'csv':
+        with open(fname, 'wb') as f:
+            return _write_csv(f, reviews)
+    elif fmt == 'jsonl':
+        with open(fname, 'w') as f:
+            return _write_jsonl(f, reviews)
+    raise ValueError('Unknown review file format {!r}'.format(fmt))
+
+def read_reviews(fname, fmt='csv'):
+    """
+    Return a list of the valid reviews in a file written by write_reviews,
+    or by Review.csv() for CSV. Raises ValueError on malformed lines.
+    """
+    if fmt == 'csv':
+        with open(fname, 'rb') as f:
+            return _read_csv(f, fname)
+    elif fmt == 'jsonl':
+        with open(fname, 'r') as f:
+            return _read_jsonl(f, fname)
+    raise ValueError('Unknown review file format {!r}'.format(fmt))
+
+class ReviewerRegistry(object):
+    """ Collection of reviewers keyed by name, filled from the author field
+        of reviews as they are added """
+    def __init__(self, rev_list=()):
+        self._reviewers = {}
+        self._names = [] # in order of first appearance
+        self.extend(rev_list)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __iter__(self):
+        for name in self._names:
+            yield self._reviewers[name]
+
+    def __contains__(self, name):
+        return name in self._reviewers
+
+    def __getitem__(self, name):
+        return self._reviewers[name]
+
+    @property
+    def names(self):
+        return list(self._names)
+
+    @property
+    def author_overwrites(self):
+        """ Number of reviews whose author field was overwritten """
+        return sum(_.author_overwrites for _ in self._reviewers.values())
 
-        if rev.author not in [_.name for _ in amg_reviewers]:
-            amg_reviewers.append(Reviewer(rev.author))
+    def get(self, name, default=None):
+        return self._reviewers.get(name, default)
+
+    def add(self, rev):
+        """ Add a review to the reviewer named in its author field, creating
+            the reviewer if needed. Unscored or untitled reviews are skipped """
+        if rev.score == -1 or rev.album == '':
+            return None
+
+        try:
+            reviewer = self._reviewers[rev.author]
+        except KeyError:
+            reviewer = Reviewer(rev.author)
+            self._reviewers[rev.author] = reviewer
+            self._names.append(rev.author)
 
-        for reviewer in amg_reviewers:
-            if reviewer.name == rev.author:
-                reviewer.add_review(rev)
-                break
+        reviewer.add_review(rev)
+        return reviewer
 
-    return amg_reviewers
+    def extend(self, rev_list):
+        for rev in rev_list:
+            self.add(rev)
+
+
+def reviewers_from_reviews(rev_list):
+    """ Returns a list of reviewers inferred from the author field of
+        each review in a review list """
+    return list(ReviewerRegistry(rev_list))
@@ -0,0 +1,121 @@
+import hashlib
+import os
+import numpy as np
+
+from .parallel import read_table_parallel
+from .table import ReviewTable
+
+# Binary sidecar cache of parsed review data files. The cache holds the
+# columns of a ReviewTable and is rebuilt whenever the source file changes.
+
+_CACHE_VERSION = 1
+_CACHE_SUFFIX = '.cache.npz'
+
+
+def cache_path(path):
+    """ Location of the cache file of a review data file """
+    return path + _CACHE_SUFFIX
+
+def _file_hash(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def _encode(strings):
+    """ Store strings as a utf-8 byte string array """
+    return np.array([_.encode('utf-8') if isinstance(_, unicode) else _
+                     for _ in strings], dtype=bytes)
+
+def write_cache(table, path, stat):
+    """ Write the columns of a table parsed from path to its cache file.
+        stat is the os.stat of path from before it was parsed. If the file
+        changed since, the table may not match it and nothing is written. """
+    sha1 = _file_hash(path)
+    new_stat = os.stat(path)
+    if new_stat.st_size != stat.st_size or new_stat.st_mtime != stat.st_mtime:
+        return
+    _write_cache(table, path, stat, sha1)
+
+def _write_cache(table, path, stat, sha1):
+    tmp_name = cache_path(path) + '.tmp'
+    with open(tmp_name, 'wb') as f:
+        np.savez(f, version=_CACHE_VERSION, size=stat.st_size,
+                 mtime=stat.st_mtime, sha1=sha1,
+                 albums=_encode(table.albums), artist_ids=table.artist_ids,
+                 author_ids=table.author_ids, dates=table.dates,
+                 scores=table.scores, tag_offsets=table.tag_offsets,
+                 tag_ids=table.tag_ids, artists=_encode(table.artists),
+                 authors=_encode(table.authors), tags=_encode(table.tags))
+    os.rename(tmp_name, cache_path(path))
+
+def read_cache(path):
+    """ Return the cached table of path, or None if there is no cache or it
+        is out of date. The cache is out of date when the size of the source
+        file changed, or when its mtime and its content hash changed. If
+        only the mtime changed the cache is rewritten with the new one, so
+        later calls do not hash the file again. """
+    try:
+        cache = np.load(cache_path(path))
+    except (IOError, OSError, ValueError):
+        return None
+
+    with cache:
+        stat = os.stat(path)
+        if int(cache['version']) != _CACHE_VERSION or \
+                int(cache['size']) != stat.st_size:
+            return None
+        sha1 = None
+        if float(cache['mtime']) != stat.st_mtime:
+            sha1 = _file_hash(path)
+            if str(cache['sha1']) != sha1:
+                return None
+
+        table = ReviewTable(cache['albums'].tolist(), cache['artist_ids'],
+                            cache['author_ids'], cache['dates'], cache['scores'],
+                            cache['tag_offsets'], cache['tag_ids'],
+                            cache['artists'].tolist(), cache['authors'].tolist(),
+                            [_.decode('utf-8') for _ in cache['tags'].tolist()])
+
+    if sha1 is not None:
+        try:
+            _write_cache(table, path, stat, sha1)
+        except (IOError, OSError):
+            pass
+    return table
+
+def load_reviews(path, cache=True, processes=1):
+    """
+    Load a review data file as a ReviewTable. Files ending in .csv are read
+    as csv-style review info, files ending in .jsonl as one JSON review per
+    line, anything else as JSON dumps of reviews. CSV and JSON Lines files
+    are parsed in chunks by processes worker processes if more than one
+    (None for one per core). With cache=True the parsed columns are saved
+    next to the file and reused on later calls until the file changes.
+    """
+    if cache:
+        table = read_cache(path)
+        if table is not None:
+            return table
+
+    # taken before parsing, so a file growing meanwhile is not cached as
+    # the rows read
+    stat = os.stat(path)
+    fmt = os.path.splitext(path)[1][1:]
+    if fmt in ('csv', 'jsonl') and processes != 1:
+        table = read_table_parallel(path, fmt, processes)
+    elif fmt == 'csv':
+        table = ReviewTable.from_csv(path)
+    elif fmt == 'jsonl':
+        table = ReviewTable.from_jsonl(path)
+    else:
+        table = ReviewTable.from_json(path)
+
+    if cache:
+        try:
+            write_cache(table, path, stat)
+        except (IOError, OSError):
+            # e.g. a read-only data directory, the cache is optional
+            pass
+    return table
@@ -0,0 +1,289 @@
+import datetime as dt
+import numpy as np
+
+from .table import ReviewTable, _csr_positions
+from .timing import _month_number
+
+# Aggregation cube over author x tag x month x score. Each non-empty cell
+# holds the count, sum and sum of squares of the scores of its reviews, so
+# counts, means and standard deviations of any slice or roll-up follow
+# without going back to the reviews.
+#
+# A review with several tags is counted once per tag in the tag cells. So
+# that roll-ups that do not keep tags count every review once, the cube also
+# holds the cells of the reviews regardless of tag, marked with tag id -1.
+
+_CUBE_VERSION = 1
+_DIMS = ('author', 'tag', 'month', 'score')
+_ANY_TAG = -1
+
+
+def _score_bin(scores):
+    """ Scores are in steps of 0.5 from 0 to 5 """
+    return np.rint(np.asarray(scores, dtype=float) * 2).astype(np.int64)
+
+def _months_of(value):
+    """ Month numbers (as from timing._month_number) of a date, a datetime64,
+        a (year, month) pair or a list of them """
+    if isinstance(value, tuple):
+        return [12 * value[0] + value[1] - 1]
+    if isinstance(value, (dt.date, np.datetime64)):
+        return [int(_month_number(value))]
+    return [_months_of(_)[0] for _ in value]
+
+def _as_list(value):
+    if isinstance(value, (list, set, np.ndarray)):
+        return list(value)
+    return [value]
+
+
+class ReviewCube(object):
+    """
+    Sparse aggregation cube of review scores. Dimensions are author, tag,
+    month and score (in 0.5 steps); roll-ups may also group months by year.
+    slice() keeps the cells matching given values and rollup() sums cells
+    over the dimensions it drops, both returning new cubes, e.g.
+
+        cube.slice(author='Steel Druhm').rollup('year')
+
+    Cell values are in the counts, sums, sumsqs properties, with labels(dim)
+    giving the value of a dimension for each cell, and to_array() makes a
+    dense array of them.
+    """
+    def __init__(self, coords, counts, sums, sumsqs, authors, tags):
+        self._coords = coords # dimension name -> int array of cell coordinates
+        self._counts = np.asarray(counts, dtype=np.int64)
+        self._sums = np.asarray(sums, dtype=float)
+        self._sumsqs = np.asarray(sumsqs, dtype=float)
+        self._authors = list(authors)
+        self._tags = list(tags)
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __repr__(self):
+        return 'ReviewCube over {} with {} cells'.format(
+            ' x '.join(self.dims) or 'no dimensions', len(self))
+
+    @property
+    def dims(self):
+        return tuple(_ for _ in _DIMS + ('year',) if _ in self._coords)
+
+    @property
+    def counts(self):
+        return self._counts
+
+    @property
+    def sums(self):
+        return self._sums
+
+    @property
+    def sumsqs(self):
+        return self._sumsqs
+
+    @property
+    def authors(self):
+        return self._authors
+
+    @property
+    def tags(self):
+        return self._tags
+
+    def means(self):
+        """ Mean score of each cell """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self._counts > 0, self._sums / self._counts, np.nan)
+
+    def stds(self):
+        """ Population standard deviation of the scores of each cell """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = self._sums / self._counts
+            var = np.where(self._counts > 0, self._sumsqs / self._counts - means ** 2, np.nan)
+        return np.sqrt(np.maximum(var, 0.))
+
+    def count(self):
+        """ Total number of reviews (of review tags, in the tag cells) """
+        return int(self._reviews()._counts.sum())
+
+    def mean(self):
+        """ Mean score over the whole cube """
+        cube = self._reviews()
+        total = cube._counts.sum()
+        return cube._sums.sum() / total if total > 0 else np.nan
+
+    @staticmethod
+    def from_table(table):
+        """ Build the cube from the columns of a ReviewTable in one pass """
+        n = len(table)
+        positions, tag_counts = _csr_positions(table.tag_offsets, np.arange(n))
+        rows = np.concatenate([np.arange(n), np.repeat(np.arange(n), tag_counts)])
+        tags = np.concatenate([np.full(n, _ANY_TAG, dtype=np.int64),
+                               table.tag_ids[positions].astype(np.int64)])
+
+        scores = table.scores.astype(float)[rows]
+        coords = {'author': table.author_ids.astype(np.int64)[rows], 'tag': tags,
+                  'month': _month_number(table.dates)[rows],
+                  'score': _score_bin(scores)}
+        return ReviewCube._aggregate(coords, np.ones(len(rows), dtype=np.int64),
+                                     scores, scores * scores,
+                                     table.authors, table.tags)
+
+    @staticmethod
+    def from_reviews(reviews):
+        """ Build the cube from an iterable of review objects """
+        return ReviewCube.from_table(ReviewTable.from_reviews(reviews))
+
+    @staticmethod
+    def _aggregate(coords, counts, sums, sumsqs, authors, tags):
+        """ Sum the values of entries with equal coordinates into cells """
+        dims = [_ for _ in _DIMS + ('year',) if _ in coords]
+        if len(counts) == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return ReviewCube(dict((_, empty) for _ in dims), empty, empty,
+                              empty, authors, tags)
+
+        lows = [coords[_].min() for _ in dims]
+        shape = [int(coords[_].max() - low + 1) for _, low in zip(dims, lows)]
+        if dims:
+            keys = np.ravel_multi_index([coords[_] - low for _, low in zip(dims, lows)],
+                                        shape)
+        else:
+            keys = np.zeros(len(counts), dtype=np.int64)
+        keys, cells = np.unique(keys, return_inverse=True)
+        cell_coords = np.unravel_index(keys, shape) if dims else ()
+        return ReviewCube(
+            dict((dim, cell_coords[i] + lows[i]) for i, dim in enumerate(dims)),
+            np.bincount(cells, weights=counts).astype(np.int64),
+            np.bincount(cells, weights=sums), np.bincount(cells, weights=sumsqs),
+            authors, tags)
+
+    def _select(self, mask):
+        return ReviewCube(dict((dim, coords[mask]) for dim, coords in self._coords.items()),
+                          self._counts[mask], self._sums[mask], self._sumsqs[mask],
+                          self._authors, self._tags)
+
+    def _reviews(self):
+        """ The cube without the per-tag cells, unless it was sliced by tag """
+        if 'tag' in self._coords and (self._coords['tag'] == _ANY_TAG).any():
+            return self._select(self._coords['tag'] == _ANY_TAG)
+        return self
+
+    def slice(self, **values):
+        """
+        Cube of the cells matching the given values of dimensions: author
+        and tag names, scores, years and months as dates or (year, month)
+        pairs. Each value may also be a list of values to keep.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for dim in sorted(values):
+            value = _as_list(values[dim])
+            if dim == 'author':
+                codes = [i for i, _ in enumerate(self._authors) if _ in value]
+            elif dim == 'tag':
+                codes = [i for i, _ in enumerate(self._tags) if _ in value]
+            elif dim == 'score':
+                codes = _score_bin(value)
+            elif dim == 'month':
+                codes = _months_of(values[dim])
+            elif dim == 'year':
+                codes = value
+            else:
+                raise ValueError('Unknown cube dimension {!r}'.format(dim))
+
+            if dim == 'year' and 'year' not in self._coords:
+                if 'month' not in self._coords:
+                    raise ValueError('Cube has no year or month dimension')
+                mask &= np.in1d(self._coords['month'] // 12, codes)
+            elif dim not in self._coords:
+                raise ValueError('Cube has no {} dimension'.format(dim))
+            else:
+                mask &= np.in1d(self._coords[dim], codes)
+        return self._select(mask)
+
+    def rollup(self, *dims):
+        """
+        Cube keeping only the given dimensions, summing the cells over the
+        others. 'year' groups months by year. Unless 'tag' is kept (or the
+        cube was sliced by tag) every review is counted once.
+        """
+        for dim in dims:
+            if dim not in self._coords and not (dim == 'year' and 'month' in self._coords):
+                raise ValueError('Cube has no {} dimension'.format(dim))
+        if 'tag' in dims:
+            cube = self._select(self._coords['tag'] != _ANY_TAG)
+        else:
+            cube = self._reviews()
+
+        coords = {}
+        for dim in dims:
+            if dim == 'year' and 'year' not in cube._coords:
+                coords[dim] = cube._coords['month'] // 12
+            else:
+                coords[dim] = cube._coords[dim]
+        return ReviewCube._aggregate(coords, cube._counts, cube._sums,
+                                     cube._sumsqs, self._authors, self._tags)
+
+    def labels(self, dim):
+        """ Value of a dimension for each cell: author or tag names, scores,
+            years or months as datetime64[M] """
+        return self._labels(dim, self._coords[dim])
+
+    def _labels(self, dim, coords):
+        if dim == 'author':
+            return np.array(self._authors, dtype=object)[coords]
+        if dim == 'tag':
+            names = np.array(self._tags + [None], dtype=object)
+            return names[coords] # tag id -1 is the last, None
+        if dim == 'score':
+            return coords / 2.
+        if dim == 'month':
+            return (coords - 12 * 1970).astype('datetime64[M]')
+        return coords
+
+    def to_array(self, stat='counts'):
+        """
+        Dense array of a cell statistic ('counts', 'sums', 'sumsqs', 'means'
+        or 'stds') with one axis per dimension, and the labels of each axis.
+        Month and year axes cover every period from the first to the last,
+        the others the values present. Missing cells are 0, or nan for
+        means and stds.
+        """
+        values = {'counts': self._counts, 'sums': self._sums, 'sumsqs': self._sumsqs,
+                  'means': self.means(), 'stds': self.stds()}[stat]
+        axes = []
+        index = []
+        for dim in self.dims:
+            coords = self._coords[dim]
+            if dim in ('month', 'year') and len(coords):
+                axis = np.arange(coords.min(), coords.max() + 1)
+            else:
+                axis = np.unique(coords)
+            index.append(np.searchsorted(axis, coords))
+            axes.append(self._labels(dim, axis))
+
+        fill = np.nan if stat in ('means', 'stds') else 0
+        array = np.full([len(_) for _ in axes], fill, dtype=values.dtype)
+        array[tuple(index)] = values
+        return array, axes
+
+    def save(self, path):
+        """ Write the cube to an .npz file """
+        from .cache import _encode
+
+        np.savez(path, version=_CUBE_VERSION, dims=_encode(self.dims),
+                 counts=self._counts, sums=self._sums, sumsqs=self._sumsqs,
+                 authors=_encode(self._authors), tags=_encode(self._tags),
+                 **dict(('coord_' + dim, coords) for dim, coords in self._coords.items()))
+
+    @staticmethod
+    def load(path):
+        """ Read a cube written by save """
+        with np.load(path) as f:
+            if int(f['version']) != _CUBE_VERSION:
+                raise ValueError('{} is not a version {} review cube'.format(
+                    path, _CUBE_VERSION))
+            dims = [_.decode('ascii') for _ in f['dims'].tolist()]
+            return ReviewCube(dict((str(dim), f['coord_' + dim]) for dim in dims),
+                              f['counts'], f['sums'], f['sumsqs'],
+                              f['authors'].tolist(),
+                              [_.decode('utf-8') for _ in f['tags'].tolist()])
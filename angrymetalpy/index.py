@@ -0,0 +1,280 @@
+import datetime as dt
+import re
+import numpy as np
+
+from .table import _EPOCH_ORDINAL
+
+# Indexes over collections of reviews. Reviews are identified by their
+# position in the collection the index was built from, so results can be
+# used directly to select rows of a ReviewTable.
+
+_query_token = re.compile(r'(\(|\)|\bAND\b|\bOR\b|\bNOT\b)')
+
+
+class TagIndex(object):
+    """
+    Inverted index mapping each tag to the sorted array of ids of the
+    reviews carrying it. Reviews may be appended after construction, they
+    get the next free id.
+    """
+    def __init__(self, reviews=()):
+        self._postings = {}
+        self._arrays = {}
+        self._size = 0
+        self.extend(reviews)
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, tag):
+        return tag in self._postings
+
+    @property
+    def tags(self):
+        return list(self._postings.keys())
+
+    def add(self, review):
+        """ Index one more review and return its id """
+        rev_id = self._size
+        for tag in review.tags:
+            self._postings.setdefault(tag, []).append(rev_id)
+            self._arrays.pop(tag, None)
+        self._size += 1
+        return rev_id
+
+    def extend(self, reviews):
+        """ Index an iterable of reviews """
+        for rev in reviews:
+            self.add(rev)
+
+    @staticmethod
+    def from_table(table):
+        """ Build the index from the CSR tag columns of a ReviewTable """
+        index = TagIndex()
+        counts = np.diff(table.tag_offsets)
+        rev_ids = np.repeat(np.arange(len(table)), counts)
+        order = np.argsort(table.tag_ids, kind='mergesort')
+        bounds = np.searchsorted(table.tag_ids[order],
+                                 np.arange(len(table.tags) + 1))
+        for tag_id, tag in enumerate(table.tags):
+            ids = rev_ids[order[bounds[tag_id]:bounds[tag_id + 1]]]
+            index._postings[tag] = ids.tolist()
+            index._arrays[tag] = ids
+        index._size = len(table)
+        return index
+
+    def ids(self, tag):
+        """ Sorted array of ids of the reviews with the given tag """
+        try:
+            return self._arrays[tag]
+        except KeyError:
+            pass
+        ids = np.asarray(self._postings.get(tag, []), dtype=np.int64)
+        if tag in self._postings:
+            self._arrays[tag] = ids
+        return ids
+
+    def count(self, tag):
+        """ Number of reviews with the given tag """
+        return len(self._postings.get(tag, []))
+
+    def all_ids(self):
+        return np.arange(self._size, dtype=np.int64)
+
+    def all_of(self, tags):
+        """ Ids of reviews carrying every one of the tags """
+        tags = sorted(tags, key=self.count)
+        if len(tags) == 0:
+            return self.all_ids()
+        ids = self.ids(tags[0])
+        for tag in tags[1:]:
+            ids = np.intersect1d(ids, self.ids(tag), assume_unique=True)
+        return ids
+
+    def any_of(self, tags):
+        """ Ids of reviews carrying at least one of the tags """
+        ids = [self.ids(tag) for tag in tags]
+        if len(ids) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(ids))
+
+    def none_of(self, tags):
+        """ Ids of reviews carrying none of the tags """
+        return np.setdiff1d(self.all_ids(), self.any_of(tags), assume_unique=True)
+
+    def query(self, expression):
+        """
+        Evaluate a boolean tag expression such as
+        'Doom Metal AND NOT (Hardcore OR Sludge Metal)'. NOT binds tighter
+        than AND, which binds tighter than OR. Returns a sorted id array.
+        """
+        tokens = [_.strip() for _ in _query_token.split(expression)]
+        tokens = [_ for _ in tokens if _ != '']
+        ids, pos = self._parse_or(tokens, 0)
+        if pos != len(tokens):
+            raise ValueError('Unexpected {!r} in tag query'.format(tokens[pos]))
+        return ids
+
+    def _parse_or(self, tokens, pos):
+        ids, pos = self._parse_and(tokens, pos)
+        while pos < len(tokens) and tokens[pos] == 'OR':
+            rhs, pos = self._parse_and(tokens, pos + 1)
+            ids = np.union1d(ids, rhs)
+        return ids, pos
+
+    def _parse_and(self, tokens, pos):
+        ids, pos = self._parse_not(tokens, pos)
+        while pos < len(tokens) and tokens[pos] == 'AND':
+            if pos + 1 < len(tokens) and tokens[pos + 1] == 'NOT':
+                # avoid materializing the complement for "a AND NOT b"
+                rhs, pos = self._parse_not(tokens, pos + 2)
+                ids = np.setdiff1d(ids, rhs, assume_unique=True)
+            else:
+                rhs, pos = self._parse_not(tokens, pos + 1)
+                ids = np.intersect1d(ids, rhs, assume_unique=True)
+        return ids, pos
+
+    def _parse_not(self, tokens, pos):
+        if pos < len(tokens) and tokens[pos] == 'NOT':
+            ids, pos = self._parse_not(tokens, pos + 1)
+            return np.setdiff1d(self.all_ids(), ids, assume_unique=True), pos
+        return self._parse_term(tokens, pos)
+
+    def _parse_term(self, tokens, pos):
+        if pos >= len(tokens):
+            raise ValueError('Incomplete tag query')
+        if tokens[pos] == '(':
+            ids, pos = self._parse_or(tokens, pos + 1)
+            if pos >= len(tokens) or tokens[pos] != ')':
+                raise ValueError('Unbalanced parentheses in tag query')
+            return ids, pos + 1
+        if tokens[pos] in ('AND', 'OR', ')'):
+            raise ValueError('Unexpected {!r} in tag query'.format(tokens[pos]))
+        return self.ids(tokens[pos]), pos + 1
+
+
+def _ordinal(date):
+    """ Proleptic Gregorian ordinal of a date, datetime or datetime64 """
+    if isinstance(date, dt.date):
+        return date.toordinal()
+    return int(np.datetime64(date, 'D').astype(np.int64)) + _EPOCH_ORDINAL
+
+
+class DateIndex(object):
+    """
+    Index of reviews by date: the ordinals of their dates in sorted order
+    and the ids of the reviews in that order, ties in id order. Window
+    queries bisect the ordinals, so they cost O(log n + k) for k results,
+    and the earliest and latest dates are known in O(1).
+
+    Reviews may be appended after construction, they get the next free id.
+    Appended reviews are merged in on the next query, which only needs a
+    concatenation when they are no older than the indexed ones, as with the
+    scraper adding new reviews newest first.
+    """
+    def __init__(self, reviews=()):
+        self._ordinals = np.zeros(0, dtype=np.int64)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._pending = [] # (ordinal, id) of reviews added since the last merge
+        self._min = None
+        self._max = None
+        self._size = 0
+        self.extend(reviews)
+
+    def __len__(self):
+        return self._size
+
+    def add(self, review):
+        """ Index one more review and return its id """
+        rev_id = self._size
+        ordinal = review.date.toordinal()
+        self._pending.append((ordinal, rev_id))
+        if self._min is None or ordinal < self._min:
+            self._min = ordinal
+        if self._max is None or ordinal > self._max:
+            self._max = ordinal
+        self._size += 1
+        return rev_id
+
+    def extend(self, reviews):
+        """ Index an iterable of reviews """
+        for rev in reviews:
+            self.add(rev)
+
+    @staticmethod
+    def from_table(table):
+        """ Build the index from the date column of a ReviewTable """
+        index = DateIndex()
+        ordinals = table.dates.astype(np.int64) + _EPOCH_ORDINAL
+        order = np.argsort(ordinals, kind='mergesort')
+        index._ordinals = ordinals[order]
+        index._ids = order.astype(np.int64)
+        index._size = len(table)
+        if len(table) > 0:
+            index._min = int(index._ordinals[0])
+            index._max = int(index._ordinals[-1])
+        return index
+
+    def _merge(self):
+        """ Sort the pending reviews into the index arrays """
+        if not self._pending:
+            return
+        pending = np.array(self._pending, dtype=np.int64)
+        self._pending = []
+        pending = pending[np.lexsort((pending[:, 1], pending[:, 0]))]
+        ordinals, ids = pending[:, 0], pending[:, 1]
+
+        if len(self._ordinals) == 0 or ordinals[0] >= self._ordinals[-1]:
+            self._ordinals = np.concatenate([self._ordinals, ordinals])
+            self._ids = np.concatenate([self._ids, ids])
+        else:
+            # new ids are the largest, so they go after equal dates
+            pos = np.searchsorted(self._ordinals, ordinals, side='right')
+            self._ordinals = np.insert(self._ordinals, pos, ordinals)
+            self._ids = np.insert(self._ids, pos, ids)
+
+    def _positions(self, start, end):
+        """ Range of positions of the reviews dated from start up to but not
+            including end, either of which may be None """
+        self._merge()
+        lo = 0 if start is None else \
+            np.searchsorted(self._ordinals, _ordinal(start), side='left')
+        hi = len(self._ordinals) if end is None else \
+            np.searchsorted(self._ordinals, _ordinal(end), side='left')
+        return lo, max(lo, hi)
+
+    @property
+    def min_date(self):
+        """ Date of the earliest review, or None if empty """
+        return None if self._min is None else dt.datetime.fromordinal(self._min)
+
+    @property
+    def max_date(self):
+        """ Date of the latest review, or None if empty """
+        return None if self._max is None else dt.datetime.fromordinal(self._max)
+
+    def ids(self):
+        """ Ids of all reviews, oldest first """
+        self._merge()
+        return self._ids
+
+    def between(self, start, end):
+        """ Ids of the reviews dated from start up to but not including end,
+            oldest first. Either bound may be None for no limit. """
+        lo, hi = self._positions(start, end)
+        return self._ids[lo:hi]
+
+    def since(self, start):
+        """ Ids of the reviews dated start or later, oldest first """
+        return self.between(start, None)
+
+    def count(self, start=None, end=None):
+        """ Number of reviews dated from start up to but not including end """
+        lo, hi = self._positions(start, end)
+        return hi - lo
+
+    def latest(self, n):
+        """ Ids of the n most recent reviews, newest first """
+        self._merge()
+        n = min(n, len(self._ids))
+        return self._ids[len(self._ids) - n:][::-1]
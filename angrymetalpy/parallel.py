@@ -0,0 +1,96 @@
+import os
+from itertools import chain
+from multiprocessing import Pool, cpu_count
+
+from .angrymetalpy import _read_csv, _read_jsonl
+from .table import ReviewTable
+
+# Parallel loading of line-oriented review files (CSV and JSON Lines). The
+# file is split into byte ranges that start and end on line boundaries, each
+# range is parsed by a worker process, and the results are merged in file
+# order. This needs every review on a single line, so fields must not
+# contain newlines.
+
+_MIN_CHUNK = 1 << 20
+_MAX_CHUNK = 64 << 20
+
+_readers = {'csv': _read_csv, 'jsonl': _read_jsonl}
+
+
+def file_chunks(fname, chunk_size):
+    """ Split a file into (start, end) byte ranges of about chunk_size
+        bytes, each starting at the beginning of a line """
+    size = os.path.getsize(fname)
+    bounds = [0]
+    with open(fname, 'rb') as f:
+        while bounds[-1] + chunk_size < size:
+            # move on to the start of the next line
+            f.seek(bounds[-1] + chunk_size)
+            f.readline()
+            if f.tell() >= size:
+                break
+            bounds.append(f.tell())
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _chunk_size(fname, processes):
+    """ About four chunks per process, to even out the load """
+    size = os.path.getsize(fname)
+    return min(_MAX_CHUNK, max(_MIN_CHUNK, size // (4 * processes) + 1))
+
+
+def _parse_chunk(args):
+    """ Reviews, or a table of them, from one byte range of a file """
+    fname, fmt, start, end, as_table = args
+    with open(fname, 'rb') as f:
+        f.seek(start)
+        lines = f.read(end - start).splitlines(True)
+    name = '{} (bytes {}-{})'.format(fname, start, end)
+    reviews = _readers[fmt](lines, name)
+    if as_table:
+        return ReviewTable.from_reviews(reviews)
+    return reviews
+
+
+def _parse_chunks(fname, fmt, processes, chunk_size, as_table):
+    if fmt not in _readers:
+        raise ValueError('Unknown review file format {!r}'.format(fmt))
+    if processes is None:
+        processes = cpu_count()
+    if chunk_size is None:
+        chunk_size = _chunk_size(fname, processes)
+
+    tasks = [(fname, fmt, start, end, as_table)
+             for start, end in file_chunks(fname, chunk_size)]
+    if processes == 1 or len(tasks) == 1:
+        return [_parse_chunk(_) for _ in tasks]
+
+    pool = Pool(processes)
+    try:
+        return pool.map(_parse_chunk, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def read_reviews_parallel(fname, fmt='jsonl', processes=None, chunk_size=None):
+    """
+    Return a list of the valid reviews in a CSV or JSON Lines file, parsing
+    chunks of it in processes worker processes (by default one per core).
+    Reviews are in file order, as from read_reviews. The reviews have to be
+    sent back from the workers, so for large files read_table_parallel
+    scales better.
+    """
+    return list(chain.from_iterable(
+        _parse_chunks(fname, fmt, processes, chunk_size, False)))
+
+
+def read_table_parallel(fname, fmt='jsonl', processes=None, chunk_size=None):
+    """
+    Build a ReviewTable from a CSV or JSON Lines file, parsing chunks of it
+    in processes worker processes (by default one per core). Each worker
+    returns the columns of its chunk, which are concatenated in file order.
+    """
+    return ReviewTable.concatenate(
+        _parse_chunks(fname, fmt, processes, chunk_size, True))
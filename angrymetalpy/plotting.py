@@ -0,0 +1,32 @@
+import datetime as dt
+import numpy as np
+
+from .timing import months_between
+
+# Helpers for plotting review data with matplotlib. This module is only
+# imported when one of them is used, and takes matplotlib objects rather than
+# importing matplotlib itself.
+
+
+def set_month_axis(ax, min_date, max_date, step=12):
+    """ Given a Matplotlib axis object, set the x axis to display months """
+    num_months = months_between(min_date, max_date) + 1
+    xs = np.arange(start=0, stop=num_months, step=1)
+
+    xlabels = []
+    yr = min_date.year
+    mn = min_date.month
+    for i in range(num_months + 1):
+        d = dt.datetime(yr, mn, 1)
+        xlabels.append(dt.datetime.strftime(d, '%b-%y'))
+        mn += 1
+        if mn == 13:
+            yr += 1
+            mn = 1
+
+    xtickpos = xs +  0.5
+    # start labels lined up with january of each year
+    offset = 13 - min_date.month
+    ax.set_xticks(xtickpos[offset::step])
+    ax.set_xticklabels(xlabels[offset::step])
+    ax.set_xlim(-1, num_months + 1)
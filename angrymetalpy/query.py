@@ -0,0 +1,474 @@
+from collections import OrderedDict
+import datetime as dt
+import weakref
+import numpy as np
+
+from .index import TagIndex, DateIndex, _ordinal
+from .table import _EPOCH_ORDINAL, _csr_positions
+
+# Composable queries over a ReviewTable, e.g.
+#
+#   table.where(author='Steel Druhm', tags_all=['Doom Metal'],
+#               date__gte=datetime(2015, 1, 1), score__between=(3.5, 5.0))
+#
+# Conditions are field__op=value, with op one of eq (the default), ne, lt,
+# lte, gt, gte, between (inclusive) and in, plus tags_all, tags_any and
+# tags_none. Queries are evaluated on demand: a planner picks the most
+# selective of the tag, date and author indexes of the table to get the
+# candidate rows, and the other conditions are evaluated as vectorized
+# masks over the columns of the candidates.
+
+_FIELDS = ('album', 'artist', 'author', 'date', 'score')
+_OPS = ('eq', 'ne', 'lt', 'lte', 'gt', 'gte', 'between', 'in')
+_TAG_OPS = ('tags_all', 'tags_any', 'tags_none')
+_RANGE_OPS = ('eq', 'lt', 'lte', 'gt', 'gte', 'between')
+
+_compare = {'eq': np.equal, 'ne': np.not_equal, 'lt': np.less,
+            'lte': np.less_equal, 'gt': np.greater, 'gte': np.greater_equal}
+
+
+def _parse_condition(key, value):
+    """ (field, op, value) of a keyword condition """
+    if key in _TAG_OPS:
+        if isinstance(value, (str, type(u''))):
+            value = [value]
+        return 'tags', key[5:], list(value)
+    field, _, op = key.partition('__')
+    op = op or 'eq'
+    if field not in _FIELDS:
+        raise ValueError('Unknown query field {!r}'.format(field))
+    if op not in _OPS:
+        raise ValueError('Unknown query operator {!r}'.format(op))
+    if op == 'between':
+        value = tuple(value)
+        if len(value) != 2:
+            raise ValueError('between needs a (low, high) pair')
+    elif op == 'in':
+        value = list(value)
+    return field, op, value
+
+
+def _day_range(conditions):
+    """ Combine date range conditions into a [start, end) pair of ordinals,
+        either of which may be None for no limit """
+    start = end = None
+    for op, value in conditions:
+        if op == 'between':
+            lo, hi = _ordinal(value[0]), _ordinal(value[1]) + 1
+        elif op == 'eq':
+            lo, hi = _ordinal(value), _ordinal(value) + 1
+        elif op in ('gt', 'gte'):
+            lo, hi = _ordinal(value) + (op == 'gt'), None
+        else:
+            lo, hi = None, _ordinal(value) + (op == 'lte')
+        if lo is not None:
+            start = lo if start is None else max(start, lo)
+        if hi is not None:
+            end = hi if end is None else min(end, hi)
+    return start, end
+
+
+class _Indexes(object):
+    """ Indexes of a table, built on first use and kept for later queries.
+        The table owns its indexes, so they only refer back to it weakly
+        and it can be freed as soon as it is no longer used. """
+    def __init__(self, table):
+        self._table = weakref.ref(table)
+        self._tag_index = None
+        self._date_index = None
+        self._author_rows = None
+        self._codes = {}
+
+    @property
+    def table(self):
+        return self._table()
+
+    @property
+    def tags(self):
+        if self._tag_index is None:
+            self._tag_index = TagIndex.from_table(self.table)
+        return self._tag_index
+
+    @property
+    def dates(self):
+        if self._date_index is None:
+            self._date_index = DateIndex.from_table(self.table)
+        return self._date_index
+
+    def codes(self, field):
+        """ Dictionary mapping the names of the authors, artists or tags of
+            the table to their ids """
+        if field not in self._codes:
+            names = {'author': self.table.authors, 'artist': self.table.artists,
+                     'tags': self.table.tags}[field]
+            self._codes[field] = dict((name, i) for i, name in enumerate(names))
+        return self._codes[field]
+
+    def author_rows(self, names):
+        """ Sorted ids of the reviews by any of the named authors """
+        if self._author_rows is None:
+            # group row ids by author, CSR style
+            order = np.argsort(self.table.author_ids, kind='mergesort')
+            bounds = np.searchsorted(self.table.author_ids[order],
+                                     np.arange(len(self.table.authors) + 1))
+            self._author_rows = (order.astype(np.int64), bounds)
+        order, bounds = self._author_rows
+        codes = self.codes('author')
+        ids = [order[bounds[codes[_]]:bounds[codes[_] + 1]]
+               for _ in names if _ in codes]
+        if len(ids) == 1:
+            return ids[0]
+        return np.sort(np.concatenate(ids)) if ids else np.zeros(0, dtype=np.int64)
+
+    def author_count(self, names):
+        self.author_rows(())
+        bounds = self._author_rows[1]
+        codes = self.codes('author')
+        return sum(bounds[codes[_] + 1] - bounds[codes[_]] for _ in names if _ in codes)
+
+
+def indexes(table):
+    """ The _Indexes of a table, created on first use """
+    if table._query_indexes is None:
+        table._query_indexes = _Indexes(table)
+    return table._query_indexes
+
+
+class Query(object):
+    """
+    Selection of rows of a ReviewTable. Queries are immutable: where,
+    order_by and top_k return new queries, and nothing is evaluated until
+    the results are asked for, through ids, len, iteration or group_by.
+    """
+    def __init__(self, table, conditions=(), order=(), limit=None, rows=None):
+        self._table = table
+        self._conditions = tuple(conditions)
+        self._order = tuple(order)
+        self._limit = limit
+        self._rows = rows # sorted ids the query is restricted to, or None
+        self._result = None
+
+    def __repr__(self):
+        return 'Query({})'.format(', '.join(
+            ['{} rows'.format(len(self._rows)) for _ in [self._rows] if _ is not None] +
+            ['{}{}{}={!r}'.format(field, '_' if field == 'tags' else '__', op, value)
+             for field, op, value in self._conditions] +
+            ['order_by={!r}'.format(_) for _ in self._order] +
+            ['limit={}'.format(self._limit)] * (self._limit is not None)))
+
+    @property
+    def table(self):
+        return self._table
+
+    def _derive(self, conditions=(), order=None, limit=None):
+        if self._limit is not None and (conditions or order is not None):
+            # conditions and orderings after a limit apply to the rows kept
+            base = Query(self._table, order=self._order, rows=np.sort(self.ids()))
+            return base._derive(conditions, order, limit)
+        if limit is not None and self._limit is not None:
+            limit = min(limit, self._limit)
+        return Query(self._table, self._conditions + tuple(conditions),
+                     self._order if order is None else order,
+                     self._limit if limit is None else limit, self._rows)
+
+    def where(self, **conditions):
+        """ Query for the rows also matching every one of the conditions """
+        parsed = [_parse_condition(key, conditions[key]) for key in sorted(conditions)]
+        return self._derive(conditions=parsed)
+
+    def order_by(self, *fields):
+        """ Query returning rows sorted by the fields, in order of priority.
+            Prefix a field with '-' for descending order. Ties keep the
+            order of the table. """
+        for field in fields:
+            if field.lstrip('-') not in _FIELDS:
+                raise ValueError('Unknown query field {!r}'.format(field))
+        return self._derive(order=tuple(fields))
+
+    def limit(self, n):
+        """ Query returning at most the first n rows """
+        return self._derive(limit=n)
+
+    def top_k(self, k, by='score'):
+        """ Query for the k rows with the highest values of a field, highest
+            first. Use '-score' etc. for the lowest. """
+        field = by[1:] if by.startswith('-') else '-' + by
+        return self.order_by(field).limit(k)
+
+    def plan(self):
+        """ Describe how the query is evaluated: the index used to find the
+            candidate rows, how many there are, and the conditions that are
+            evaluated over their columns """
+        access, count, residual = self._plan()
+        return '{} ({} rows), then filter on {}'.format(
+            access, count, ', '.join(residual) or 'nothing')
+
+    def _plan(self):
+        """ Choose the access path. Returns its name, the number of
+            candidate rows and the names of the remaining conditions. """
+        idx = indexes(self._table)
+        if self._rows is None:
+            options = [('scan', len(self._table))]
+        else:
+            options = [('rows', len(self._rows))]
+        dates = [(op, value) for field, op, value in self._conditions
+                 if field == 'date' and op in _RANGE_OPS]
+        if dates:
+            start, end = _day_range(dates)
+            if start is not None and end is not None and end < start:
+                end = start
+            options.append(('date', idx.dates.count(
+                None if start is None else dt.date.fromordinal(start),
+                None if end is None else dt.date.fromordinal(end))))
+        for field, op, value in self._conditions:
+            if field == 'author' and op in ('eq', 'in'):
+                options.append(('author', idx.author_count(
+                    value if op == 'in' else [value])))
+            elif field == 'tags' and op == 'all' and value:
+                options.append(('tags', min(idx.tags.count(_) for _ in value)))
+            elif field == 'tags' and op == 'any':
+                options.append(('tags', sum(idx.tags.count(_) for _ in value)))
+        # min keeps the first of equals, so ties go to the plain scan
+        access, count = min(options, key=lambda _: _[1])
+        residual = ['{}__{}'.format(field, op) for field, op, _ in self._conditions
+                    if not self._uses(access, field, op)]
+        return access, count, residual
+
+    @staticmethod
+    def _uses(access, field, op):
+        """ Whether the access path already applies a condition """
+        if access == 'date':
+            return field == 'date' and op in _RANGE_OPS
+        if access == 'author':
+            return field == 'author' and op in ('eq', 'in')
+        if access == 'tags':
+            return field == 'tags' and op in ('all', 'any')
+        return False
+
+    def _candidates(self, access):
+        """ Sorted ids of the rows found by the access path """
+        idx = indexes(self._table)
+        if access == 'scan':
+            return np.arange(len(self._table), dtype=np.int64)
+        if access == 'rows':
+            return self._rows
+        if access == 'date':
+            start, end = _day_range([(op, value) for field, op, value in self._conditions
+                                     if field == 'date' and op in _RANGE_OPS])
+            if start is not None and end is not None and end < start:
+                return np.zeros(0, dtype=np.int64)
+            return np.sort(idx.dates.between(
+                None if start is None else dt.date.fromordinal(start),
+                None if end is None else dt.date.fromordinal(end)))
+        ids = None
+        for field, op, value in self._conditions:
+            if not self._uses(access, field, op):
+                continue
+            if field == 'author':
+                rows = idx.author_rows(value if op == 'in' else [value])
+            elif op == 'all':
+                rows = idx.tags.all_of(value)
+            else:
+                rows = idx.tags.any_of(value)
+            ids = rows if ids is None else np.intersect1d(ids, rows, assume_unique=True)
+        return ids
+
+    def _mask(self, ids, field, op, value):
+        """ Boolean mask of the rows ids matching one condition """
+        table = self._table
+        if field == 'tags':
+            return self._tag_mask(ids, op, value)
+
+        if field in ('author', 'artist'):
+            codes = indexes(table).codes(field)
+            column = (table.author_ids if field == 'author' else table.artist_ids)[ids]
+            if op not in ('eq', 'ne', 'in'):
+                raise ValueError('{} only supports eq, ne and in'.format(field))
+            if op == 'in':
+                return np.in1d(column, [codes[_] for _ in value if _ in codes])
+            match = column == codes.get(value, -1)
+            return match if op == 'eq' else ~match
+
+        if field == 'date':
+            column = table.dates[ids].astype(np.int64) + _EPOCH_ORDINAL
+            convert = _ordinal
+        elif field == 'score':
+            column = table.scores[ids]
+            convert = np.float32
+        else:
+            column = table.albums[ids]
+            convert = lambda _: _
+        if op == 'between':
+            return (column >= convert(value[0])) & (column <= convert(value[1]))
+        if op == 'in':
+            return np.in1d(column, [convert(_) for _ in value])
+        return _compare[op](column, convert(value))
+
+    def _tag_mask(self, ids, op, tags):
+        """ Match tag conditions by counting the wanted tags of each row """
+        table = self._table
+        codes = indexes(table).codes('tags')
+        wanted = [codes[_] for _ in set(tags) if _ in codes]
+        if op == 'all' and len(wanted) < len(set(tags)):
+            return np.zeros(len(ids), dtype=bool)
+        positions, counts = _csr_positions(table.tag_offsets, ids)
+        hits = np.in1d(table.tag_ids[positions], wanted)
+        rows = np.repeat(np.arange(len(ids)), counts)
+        matched = np.bincount(rows[hits], minlength=len(ids))
+        if op == 'all':
+            return matched == len(wanted)
+        if op == 'any':
+            return matched > 0
+        return matched == 0
+
+    def _sort_key(self, field, ids):
+        """ Values of a field for the rows ids, as a sortable numeric array """
+        table = self._table
+        if field == 'score':
+            return table.scores[ids]
+        if field == 'date':
+            return table.dates[ids].astype(np.int64)
+        if field == 'album':
+            return np.unique(table.albums[ids], return_inverse=True)[1]
+        names = table.authors if field == 'author' else table.artists
+        # rank of each name in alphabetical order
+        rank = np.empty(len(names), dtype=np.int64)
+        rank[np.argsort(np.array(names, dtype=object))] = np.arange(len(names))
+        return rank[(table.author_ids if field == 'author' else table.artist_ids)[ids]]
+
+    def _sorted(self, ids):
+        """ Apply the ordering and the limit to the matching rows """
+        if not self._order:
+            return ids if self._limit is None else ids[:self._limit]
+        keys = []
+        for field in self._order:
+            key = self._sort_key(field.lstrip('-'), ids)
+            keys.append(-key if field.startswith('-') else key)
+
+        if self._limit is not None and len(keys) == 1 and 0 < self._limit < len(ids):
+            # partial sort: only the first limit rows need ordering
+            key = keys[0]
+            part = np.argpartition(key, self._limit - 1)[:self._limit]
+            # rows tied with the last one kept are chosen in table order
+            cutoff = key[part].max()
+            part = np.concatenate([np.flatnonzero(key < cutoff),
+                                   np.flatnonzero(key == cutoff)])
+            order = part[np.lexsort((part, key[part]))][:self._limit]
+            return ids[order]
+
+        order = np.lexsort([np.arange(len(ids))] + keys[::-1])
+        return ids[order] if self._limit is None else ids[order[:self._limit]]
+
+    def ids(self):
+        """ Array of the ids of the matching rows, in table order unless the
+            query is ordered """
+        if self._result is None:
+            access, _, _ = self._plan()
+            ids = self._candidates(access)
+            if self._rows is not None and access != 'rows':
+                ids = np.intersect1d(ids, self._rows, assume_unique=True)
+            for field, op, value in self._conditions:
+                if not self._uses(access, field, op) and len(ids):
+                    ids = ids[self._mask(ids, field, op, value)]
+            self._result = self._sorted(ids)
+        return self._result
+
+    def __len__(self):
+        return len(self.ids())
+
+    def count(self):
+        """ Number of matching rows """
+        return len(self)
+
+    def __iter__(self):
+        for i in self.ids():
+            yield self._table.review(i)
+
+    def reviews(self):
+        """ List of review objects of the matching rows """
+        return list(self)
+
+    def first(self):
+        """ The first matching review, or None """
+        ids = self.ids()
+        return self._table.review(ids[0]) if len(ids) else None
+
+    def column(self, field):
+        """ Values of a field for the matching rows: scores, dates, albums
+            or author or artist names """
+        ids = self.ids()
+        table = self._table
+        if field == 'score':
+            return table.scores[ids]
+        if field == 'date':
+            return table.dates[ids]
+        if field == 'album':
+            return table.albums[ids]
+        if field in ('author', 'artist'):
+            names = np.array(table.authors if field == 'author' else table.artists,
+                             dtype=object)
+            return names[(table.author_ids if field == 'author' else table.artist_ids)[ids]]
+        raise ValueError('Unknown query field {!r}'.format(field))
+
+    def mean(self, field='score'):
+        """ Mean of a numeric field over the matching rows (nan if none) """
+        values = self.column(field).astype(np.float64)
+        return values.mean() if len(values) else np.nan
+
+    def to_table(self):
+        """ A new ReviewTable with the matching rows """
+        return self._table.take(self.ids())
+
+    def group_by(self, key):
+        """
+        Split the matching rows into groups, returning an ordered dictionary
+        from each value of the key to a query for its rows. The key is
+        author, artist, score, year, month (as (year, month) pairs) or tag;
+        a review with several tags is in the group of each of them. Groups
+        are in ascending order of key, the rows of a group in query order.
+        """
+        ids = self.ids()
+        table = self._table
+        names = None
+        if key == 'tag':
+            positions, counts = _csr_positions(table.tag_offsets, ids)
+            codes = table.tag_ids[positions].astype(np.int64)
+            ids = np.repeat(ids, counts)
+            names = table.tags
+        elif key in ('author', 'artist'):
+            codes = (table.author_ids if key == 'author' else table.artist_ids)[ids]
+            names = table.authors if key == 'author' else table.artists
+        elif key == 'score':
+            codes = table.scores[ids]
+        elif key == 'year':
+            codes = table.dates[ids].astype('datetime64[Y]').astype(np.int64) + 1970
+        elif key == 'month':
+            codes = table.dates[ids].astype('datetime64[M]').astype(np.int64)
+        else:
+            raise ValueError('Unknown group_by key {!r}'.format(key))
+
+        order = np.argsort(codes, kind='mergesort')
+        codes = codes[order]
+        ids = ids[order]
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) else []
+        bounds = list(starts) + [len(codes)]
+
+        values = [codes[_] for _ in starts]
+        if names is not None:
+            values = [names[_] for _ in values]
+            # by name rather than id
+            keyed = sorted(range(len(values)), key=lambda _: values[_])
+        else:
+            keyed = range(len(values))
+        groups = OrderedDict()
+        for g in keyed:
+            value = values[g]
+            if key == 'score':
+                value = float(value)
+            elif key == 'year':
+                value = int(value)
+            elif key == 'month':
+                value = (int(value) // 12 + 1970, int(value) % 12 + 1)
+            groups[value] = Query(self._table, order=self._order,
+                                  rows=np.sort(ids[bounds[g]:bounds[g + 1]]))
+        return groups
@@ -0,0 +1,170 @@
+from collections import namedtuple
+import numpy as np
+
+from .timing import months_between, _month_number
+
+# Analysis of batches of monthly time series, such as the average score of
+# every tag or every reviewer per month. Series are the rows of a 2d array
+# with one column per month; months without data are nan.
+
+# Monthly aggregates of a set of series, each field but labels and start a
+# (series x months) array. start is the first month as datetime64[M].
+MonthlySeries = namedtuple('MonthlySeries', ['labels', 'start', 'counts', 'sums',
+                                             'means', 'errs'])
+
+# Result of fitting y = intercept + slope * x to each series. Every field
+# is an array with one value per series; cov is the covariance of the
+# intercept and slope. Series with fewer than two points have nan fits.
+TrendFit = namedtuple('TrendFit', ['intercept', 'slope', 'intercept_err',
+                                   'slope_err', 'cov', 'chisq', 'dof'])
+
+# Autocorrelation of each series at lags 0 to maxlags: the lags, the
+# autocorrelation and confidence band half-widths, each (series x lags),
+# and the number of pairs of months with data at each lag.
+Autocorrelation = namedtuple('Autocorrelation', ['lags', 'acf', 'conf', 'pairs'])
+
+
+def monthly_series(cube, dim, start=None, end=None):
+    """
+    Monthly series of the review counts, score sums, mean scores and the
+    uncertainty sqrt(counts) / counts of each value of a dimension of a
+    ReviewCube ('author' or 'tag'), from the month of start to the month of
+    end (default to the range of the data). Rows are ordered by label.
+    Months without reviews have a count of 0 and a nan mean and uncertainty.
+    """
+    cells = cube.rollup(dim, 'month')
+    months = cells.labels('month')
+    first = _month_number(months.min() if start is None else start)
+    last = _month_number(months.max() if end is None else end)
+    num_months = max(int(last - first) + 1, 0)
+    first = np.datetime64(int(first) - 12 * 1970, 'M')
+
+    labels, rows = np.unique(cells.labels(dim), return_inverse=True)
+    cols = months_between(first, months)
+    keep = (cols >= 0) & (cols < num_months)
+
+    counts = np.zeros((len(labels), num_months), dtype=np.int64)
+    sums = np.zeros((len(labels), num_months))
+    counts[rows[keep], cols[keep]] = cells.counts[keep]
+    sums[rows[keep], cols[keep]] = cells.sums[keep]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = np.where(counts > 0, sums / counts, np.nan)
+        errs = np.where(counts > 0, np.sqrt(counts) / counts, np.nan)
+    return MonthlySeries(list(labels), first, counts, sums, means, errs)
+
+
+def fit_linear_trends(y, err=None, x=None):
+    """
+    Weighted least squares fits of y = intercept + slope * x to every row of
+    y at once, in closed form. err holds the uncertainty of each value
+    (default 1) and x the positions of the columns (default 0, 1, ...).
+    Values that are nan, or have a nan or non-positive error, are left out
+    of the fit of their series. A 1d y is fitted as a single series.
+    Returns a TrendFit with the parameters, their standard errors and
+    covariance, and the chi-square and degrees of freedom of each fit.
+    """
+    y = np.asarray(y, dtype=float)
+    single = y.ndim == 1
+    y = np.atleast_2d(y)
+    x = np.arange(y.shape[1], dtype=float) if x is None else np.asarray(x, dtype=float)
+    err = np.ones_like(y) if err is None else np.atleast_2d(np.asarray(err, dtype=float))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        valid = np.isfinite(y) & np.isfinite(err) & (err > 0)
+        w = np.where(valid, 1. / np.where(valid, err, 1.) ** 2, 0.)
+        y = np.where(valid, y, 0.)
+        n = valid.sum(axis=1)
+
+        # fit around the weighted mean of x, where slope and intercept
+        # estimates are uncorrelated, for numerical stability
+        s = w.sum(axis=1)
+        x_mean = np.dot(w, x) / s
+        dx = x - x_mean[:, np.newaxis]
+        sxx = (w * dx * dx).sum(axis=1)
+        slope = (w * dx * y).sum(axis=1) / sxx
+        y_mean = (w * y).sum(axis=1) / s
+        intercept = y_mean - slope * x_mean
+
+        slope_var = 1. / sxx
+        intercept_var = 1. / s + x_mean ** 2 * slope_var
+        cov = -x_mean * slope_var
+
+        res = y - intercept[:, np.newaxis] - slope[:, np.newaxis] * x
+        chisq = (w * res * res).sum(axis=1)
+
+    bad = n < 2
+    for values in (intercept, slope, intercept_var, slope_var, cov, chisq):
+        values[bad] = np.nan
+    fit = TrendFit(intercept, slope, np.sqrt(intercept_var), np.sqrt(slope_var),
+                   cov, chisq, n - 2)
+    if single:
+        return TrendFit(*[_[0] for _ in fit])
+    return fit
+
+
+def trend_values(fit, x):
+    """ Values of fitted trends at positions x, one row per series for
+        batched fits """
+    x = np.asarray(x, dtype=float)
+    intercept = np.asarray(fit.intercept, dtype=float)
+    slope = np.asarray(fit.slope, dtype=float)
+    return intercept[..., np.newaxis] + slope[..., np.newaxis] * x
+
+
+def autocorrelation(series, maxlags=None, demean=True, adjusted=False,
+                    bartlett=False, z=1.96):
+    """
+    Autocorrelation of every row of series at lags 0 to maxlags (default
+    all), computed for the whole batch with FFTs in O(n log n) per series.
+    Missing months (nan) are left out: they do not contribute to any lagged
+    product, so a month pair counts only if both months have data.
+
+    With demean the mean of each series is removed first (matplotlib's
+    acorr does not). The autocovariance at each lag is divided by the
+    number of months with data, or with adjusted by the number of pairs at
+    that lag. conf holds the half-width of the band outside of which an
+    autocorrelation is significant, z / sqrt(n) for white noise, or from
+    Bartlett's formula for a moving average process of order lag - 1 with
+    bartlett. z = 1.96 gives 95% bands. Bands are 0 at lag 0. A 1d series
+    gives 1d results.
+    """
+    x = np.asarray(series, dtype=float)
+    single = x.ndim == 1
+    x = np.atleast_2d(x)
+    n = x.shape[1]
+    maxlags = n - 1 if maxlags is None else min(maxlags, n - 1)
+    lags = np.arange(maxlags + 1)
+
+    valid = np.isfinite(x)
+    counts = valid.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if demean:
+            x = x - (np.where(valid, x, 0.).sum(axis=1) / counts)[:, np.newaxis]
+        x = np.where(valid, x, 0.)
+
+        # zero padding to at least 2n - 1 points keeps the circular
+        # correlation of the FFT from wrapping around
+        size = 1 << (2 * n - 2).bit_length() if n > 1 else 1
+        fx = np.fft.rfft(x, size, axis=1)
+        fm = np.fft.rfft(valid.astype(float), size, axis=1)
+        sums = np.fft.irfft(fx * fx.conj(), size, axis=1)[:, :maxlags + 1]
+        pairs = np.rint(np.fft.irfft(fm * fm.conj(), size, axis=1)[:, :maxlags + 1])
+        pairs = pairs.astype(np.int64)
+
+        divisor = pairs if adjusted else counts[:, np.newaxis]
+        acov = np.where(pairs > 0, sums / divisor, np.nan)
+        acf = acov / acov[:, :1]
+
+        if bartlett:
+            # var(r_k) = (1 + 2 sum_{j<k} r_j^2) / n
+            sq = np.cumsum(acf[:, 1:] ** 2, axis=1)
+            var = np.concatenate([np.ones((len(x), 2)), 1 + 2 * sq[:, :-1]], axis=1)
+            var = var[:, :maxlags + 1] / counts[:, np.newaxis]
+        else:
+            var = np.ones_like(acf) / (pairs if adjusted else counts[:, np.newaxis])
+        conf = np.where(np.isnan(acf), np.nan, z * np.sqrt(var))
+        conf[:, 0] = 0.
+
+    if single:
+        return Autocorrelation(lags, acf[0], conf[0], pairs[0])
+    return Autocorrelation(lags, acf, conf, pairs)
@@ -0,0 +1,230 @@
+import datetime as dt
+import numpy as np
+
+from .angrymetalpy import Review, iter_reviews_json, reviews_from_csv, read_reviews
+
+# Columnar storage of review data, for fast aggregation over large sets of
+# reviews
+
+# datetime64[D] counts days from 1970-01-01, datetime ordinals from 0001-01-01
+_EPOCH_ORDINAL = dt.date(1970, 1, 1).toordinal()
+
+
+def _csr_positions(offsets, rows):
+    """ Positions in the CSR value array of the values of the given rows,
+        concatenated in order, and the number of values of each row """
+    starts = offsets[rows]
+    counts = offsets[np.asarray(rows) + 1] - starts
+    # shift a running count so each row continues from its own start
+    shifts = starts - (np.cumsum(counts) - counts)
+    return np.arange(counts.sum()) + np.repeat(shifts, counts), counts
+
+
+class _Encoder(object):
+    ''' Helper class to dictionary-encode repeated strings as integer ids '''
+    def __init__(self, values=()):
+        self.values = []
+        self.ids = {}
+        for value in values:
+            self.encode(value)
+
+    def encode(self, value):
+        try:
+            return self.ids[value]
+        except KeyError:
+            self.ids[value] = len(self.values)
+            self.values.append(value)
+            return self.ids[value]
+
+
+class ReviewTable(object):
+    """
+    Column-oriented collection of reviews. Dates are stored as datetime64[D],
+    scores as float32, authors and artists as integer ids into the
+    `authors` and `artists` lists and tags in CSR layout: the tags of review
+    i are `tags[tag_ids[tag_offsets[i]:tag_offsets[i + 1]]]`.
+    """
+    def __init__(self, albums, artist_ids, author_ids, dates, scores,
+                 tag_offsets, tag_ids, artists, authors, tags):
+        self._albums = np.asarray(albums, dtype=object)
+        self._artist_ids = np.asarray(artist_ids, dtype=np.int32)
+        self._author_ids = np.asarray(author_ids, dtype=np.int32)
+        self._dates = np.asarray(dates, dtype='datetime64[D]')
+        self._scores = np.asarray(scores, dtype=np.float32)
+        self._tag_offsets = np.asarray(tag_offsets, dtype=np.int64)
+        self._tag_ids = np.asarray(tag_ids, dtype=np.int32)
+        self._artists = list(artists)
+        self._authors = list(authors)
+        self._tags = list(tags)
+        self._query_indexes = None # built by the first query, see query.py
+
+    def __len__(self):
+        return len(self._scores)
+
+    def __repr__(self):
+        return 'ReviewTable of {} reviews by {} reviewers with {} tags'.format(
+            len(self), len(self._authors), len(self._tags))
+
+    @property
+    def albums(self):
+        return self._albums
+
+    @property
+    def artist_ids(self):
+        return self._artist_ids
+
+    @property
+    def author_ids(self):
+        return self._author_ids
+
+    @property
+    def dates(self):
+        return self._dates
+
+    @property
+    def scores(self):
+        return self._scores
+
+    @property
+    def tag_offsets(self):
+        return self._tag_offsets
+
+    @property
+    def tag_ids(self):
+        return self._tag_ids
+
+    @property
+    def artists(self):
+        return self._artists
+
+    @property
+    def authors(self):
+        return self._authors
+
+    @property
+    def tags(self):
+        return self._tags
+
+    def review_tags(self, i):
+        """ Return the tag names of review i """
+        ids = self._tag_ids[self._tag_offsets[i]:self._tag_offsets[i + 1]]
+        return set(self._tags[_] for _ in ids)
+
+    def review(self, i):
+        """ Build a review object from row i of the table """
+        date = dt.datetime.fromordinal(
+            int(self._dates[i].astype(np.int64)) + _EPOCH_ORDINAL)
+        return Review(self._albums[i], self._artists[self._artist_ids[i]],
+                      self._authors[self._author_ids[i]], date,
+                      self.review_tags(i), float(self._scores[i]), '')
+
+    def __getitem__(self, i):
+        return self.review(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.review(i)
+
+    def to_reviews(self):
+        """ Return a list of review objects with the contents of the table """
+        return list(self)
+
+    def take(self, rows):
+        """ Build a table from the given rows of this one, in that order.
+            The artist, author and tag lists are shared with this table. """
+        rows = np.asarray(rows, dtype=np.int64)
+        positions, counts = _csr_positions(self._tag_offsets, rows)
+        return ReviewTable(self._albums[rows], self._artist_ids[rows],
+                           self._author_ids[rows], self._dates[rows],
+                           self._scores[rows], np.r_[0, np.cumsum(counts)],
+                           self._tag_ids[positions], self._artists,
+                           self._authors, self._tags)
+
+    def query(self):
+        """ A Query selecting every row of the table """
+        from .query import Query
+        return Query(self)
+
+    def where(self, **conditions):
+        """ A Query selecting the rows matching the conditions, e.g.
+            table.where(author='Steel Druhm', score__gte=4.0). See query.py """
+        return self.query().where(**conditions)
+
+    @staticmethod
+    def from_reviews(rev_list):
+        """ Build a table from an iterable of review objects """
+        artists = _Encoder()
+        authors = _Encoder()
+        tags = _Encoder()
+
+        albums = []
+        artist_ids = []
+        author_ids = []
+        days = []
+        scores = []
+        tag_offsets = [0]
+        tag_ids = []
+        for rev in rev_list:
+            albums.append(rev.album)
+            artist_ids.append(artists.encode(rev.artist))
+            author_ids.append(authors.encode(rev.author))
+            days.append(rev.date.toordinal() - _EPOCH_ORDINAL)
+            scores.append(rev.score)
+            tag_ids.extend(tags.encode(tag) for tag in rev.tags)
+            tag_offsets.append(len(tag_ids))
+
+        return ReviewTable(albums, artist_ids, author_ids,
+                           np.asarray(days, dtype=np.int64).astype('datetime64[D]'),
+                           scores, tag_offsets, tag_ids,
+                           artists.values, authors.values, tags.values)
+
+    @staticmethod
+    def concatenate(tables):
+        """ Build one table from the rows of several, in order. The artist,
+            author and tag ids of each table are remapped to shared ones. """
+        artists = _Encoder()
+        authors = _Encoder()
+        tags = _Encoder()
+
+        def remap(encoder, values, ids):
+            mapping = np.array([encoder.encode(_) for _ in values], dtype=np.int32)
+            return mapping[ids] if len(mapping) else ids
+
+        albums = []
+        artist_ids = []
+        author_ids = []
+        dates = []
+        scores = []
+        tag_offsets = [np.zeros(1, dtype=np.int64)]
+        tag_ids = []
+        for table in tables:
+            albums.append(table.albums)
+            artist_ids.append(remap(artists, table.artists, table.artist_ids))
+            author_ids.append(remap(authors, table.authors, table.author_ids))
+            dates.append(table.dates)
+            scores.append(table.scores)
+            tag_offsets.append(table.tag_offsets[1:] + tag_offsets[-1][-1])
+            tag_ids.append(remap(tags, table.tags, table.tag_ids))
+
+        if not scores:
+            return ReviewTable.from_reviews([])
+        return ReviewTable(np.concatenate(albums), np.concatenate(artist_ids),
+                           np.concatenate(author_ids), np.concatenate(dates),
+                           np.concatenate(scores), np.concatenate(tag_offsets),
+                           np.concatenate(tag_ids), artists.values,
+                           authors.values, tags.values)
+
+    @staticmethod
+    def from_json(fname):
+        """ Build a table from a text file containing JSON dumps of review objects """
+        return ReviewTable.from_reviews(iter_reviews_json(fname))
+
+    @staticmethod
+    def from_csv(fname):
+        """ Build a table from a text file containing csv-style review info """
+        return ReviewTable.from_reviews(reviews_from_csv(fname))
+
+    @staticmethod
+    def from_jsonl(fname):
+        """ Build a table from a text file with one JSON review per line """
+        return ReviewTable.from_reviews(read_reviews(fname, fmt='jsonl'))
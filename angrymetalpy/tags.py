@@ -0,0 +1,71 @@
+import numpy as np
+
+from .table import ReviewTable
+
+# Tag statistics computed from the sparse review x tag incidence matrix.
+# These functions need scipy.
+
+
+def _as_table(reviews):
+    if isinstance(reviews, ReviewTable):
+        return reviews
+    return ReviewTable.from_reviews(reviews)
+
+def tag_incidence(reviews):
+    """
+    Return the sparse (reviews x tags) incidence matrix of a ReviewTable or
+    review list, with a 1 wherever a review carries a tag, and the list of
+    tag names labelling its columns.
+    """
+    from scipy import sparse
+
+    table = _as_table(reviews)
+    data = np.ones(len(table.tag_ids), dtype=np.int32)
+    incidence = sparse.csr_matrix((data, table.tag_ids, table.tag_offsets),
+                                  shape=(len(table), len(table.tags)))
+    return incidence, list(table.tags)
+
+def tag_cooccurrence(reviews, top_k=None, min_support=1, normalize=None):
+    """
+    Count how often each pair of tags appears on the same review, for all
+    tags at once, as a sparse (tags x tags) matrix. The diagonal holds the
+    number of reviews carrying each tag.
+
+    Tags appearing on fewer than min_support reviews are dropped, as are
+    pairs seen together fewer than min_support times. If top_k is given only
+    the k most common tags are kept. normalize may be 'jaccard', giving
+    n_ij / (n_i + n_j - n_ij), or 'pmi', giving log(N n_ij / (n_i n_j)),
+    where N is the number of reviews.
+
+    Returns the matrix and the tag names labelling its rows and columns,
+    ordered from most to least common.
+    """
+    from scipy import sparse
+
+    incidence, tags = tag_incidence(reviews)
+    support = np.asarray(incidence.sum(axis=0)).ravel()
+
+    keep = np.argsort(-support, kind='mergesort')
+    keep = keep[support[keep] >= min_support]
+    if top_k is not None:
+        keep = keep[:top_k]
+
+    incidence = incidence[:, keep]
+    support = support[keep]
+    counts = (incidence.T * incidence).tocoo()
+
+    mask = counts.data >= min_support
+    rows, cols, n_ij = counts.row[mask], counts.col[mask], counts.data[mask]
+
+    if normalize is None:
+        values = n_ij
+    elif normalize == 'jaccard':
+        values = n_ij / (support[rows] + support[cols] - n_ij).astype(float)
+    elif normalize == 'pmi':
+        n_reviews = float(incidence.shape[0])
+        values = np.log(n_reviews * n_ij / (support[rows] * support[cols].astype(float)))
+    else:
+        raise ValueError('Unknown normalization {!r}'.format(normalize))
+
+    matrix = sparse.csr_matrix((values, (rows, cols)), shape=counts.shape)
+    return matrix, [tags[_] for _ in keep]
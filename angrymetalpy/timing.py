@@ -1,51 +1,101 @@
 import datetime as dt
+from collections import namedtuple
 import numpy as np
 
 # Useful time-related functions for plotting AMG data
 
-def date_range(review_list):
-    """ Find the date range of a set of reviews """
-    min_date = None
-    max_date = None
+# Result of bucketing values by time period. start holds the first day of
+# each bucket as datetime64[D], the rest are arrays of the same length.
+Buckets = namedtuple('Buckets', ['start', 'sums', 'counts', 'means', 'errs'])
+
+# number of months per bucket for each supported bucketing frequency
+_freq_months = {'M': 1, 'Q': 3, 'Y': 12}
+
 
-    for rev in review_list:
-        if min_date is None:
-            min_date = rev.date
-            max_date = rev.date
-            continue
+def _dates_of(obj):
+    """ Return the dates of a review list, a ReviewTable or an array of dates """
+    if hasattr(obj, 'dates'):
+        return obj.dates
+    if isinstance(obj, np.ndarray):
+        return obj
+    obj = list(obj)
+    if len(obj) > 0 and isinstance(obj[0], dt.date):
+        return obj
+    return [rev.date for rev in obj]
 
-        if rev.date < min_date:
-            min_date = rev.date
-            continue
-        elif rev.date > max_date:
-            max_date = rev.date
-            continue
+def _month_number(date):
+    """ Months since year 0 of a datetime object or a datetime64 (array) """
+    if isinstance(date, (dt.date, dt.datetime)):
+        return 12 * date.year + date.month - 1
+    months = np.asarray(date).astype('datetime64[M]').astype(np.int64)
+    return months + 12 * 1970
 
-    return (min_date, max_date)
+def to_datetime(date):
+    """ Convert a datetime64 scalar to a datetime object """
+    if isinstance(date, dt.datetime):
+        return date
+    if isinstance(date, dt.date):
+        return dt.datetime(date.year, date.month, date.day)
+    days = int(np.datetime64(date, 'D').astype(np.int64))
+    return dt.datetime(1970, 1, 1) + dt.timedelta(days=days)
+
+def date_range(review_list):
+    """ Find the date range of a set of reviews. Accepts a list of reviews,
+        a ReviewTable, an array of datetime64 dates or a DateIndex, which
+        knows its range without a scan """
+    if hasattr(review_list, 'min_date'):
+        return (review_list.min_date, review_list.max_date)
+    dates = _dates_of(review_list)
+    if len(dates) == 0:
+        return (None, None)
+    if isinstance(dates, np.ndarray):
+        return (to_datetime(dates.min()), to_datetime(dates.max()))
+    return (min(dates), max(dates))
 
 def months_between(min_date, max_date):
-    """ Return number of months between two datetime objects """
-    return 12 * (max_date.year - min_date.year) - min_date.month + max_date.month
-
-def set_month_axis(ax, min_date, max_date, step=12):
-    """ Given a Matplotlib axis object, set the x axis to display months """
-    num_months = months_between(min_date, max_date) + 1
-    xs = np.arange(start=0, stop=num_months, step=1)
-
-    xlabels = []
-    yr = min_date.year
-    mn = min_date.month
-    for i in range(num_months + 1):
-        d = dt.datetime(yr, mn, 1)
-        xlabels.append(dt.datetime.strftime(d, '%b-%y'))
-        mn += 1
-        if mn == 13:
-            yr += 1
-            mn = 1
-
-    xtickpos = xs +  0.5
-    # start labels lined up with january of each year
-    offset = 13 - min_date.month
-    ax.set_xticks(xtickpos[offset::step])
-    ax.set_xticklabels(xlabels[offset::step])
-    ax.set_xlim(-1, num_months + 1)
+    """ Return number of months between two datetime objects. Either argument
+        may also be a datetime64 array, in which case an array is returned """
+    return _month_number(max_date) - _month_number(min_date)
+
+def month_index(dates, min_date=None):
+    """ Return the month index of each date in an array of dates, counting
+        from the month of min_date (defaults to the earliest date) """
+    dates = np.asarray(_dates_of(dates), dtype='datetime64[D]')
+    if min_date is None:
+        min_date = dates.min()
+    return months_between(min_date, dates)
+
+def bucket(dates, values, freq='M', start=None, end=None):
+    """
+    Sum and count values in monthly ('M'), quarterly ('Q') or yearly ('Y')
+    buckets in a single pass. Buckets are aligned to the calendar and cover
+    start to end (defaults to the range of dates), dates outside are ignored.
+    Returns the bucket start dates with the sums, counts, means and the
+    uncertainty sqrt(counts) / counts of each bucket. Empty buckets have a
+    NaN mean and uncertainty. There are no buckets if there are no dates
+    and start or end is not given.
+    """
+    step = _freq_months[freq]
+    dates = np.asarray(_dates_of(dates), dtype='datetime64[D]')
+    values = np.asarray(values, dtype=float)
+    if len(dates) == 0 and (start is None or end is None):
+        return Buckets(np.zeros(0, dtype='datetime64[D]'), np.zeros(0),
+                       np.zeros(0, dtype=np.intp), np.zeros(0), np.zeros(0))
+
+    first = _month_number(dates.min() if start is None else start) // step
+    last = _month_number(dates.max() if end is None else end) // step
+    num_buckets = max(last - first + 1, 0)
+
+    idx = _month_number(dates) // step - first
+    in_range = (idx >= 0) & (idx < num_buckets)
+    idx = idx[in_range]
+
+    counts = np.bincount(idx, minlength=num_buckets)
+    sums = np.bincount(idx, weights=values[in_range], minlength=num_buckets)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = np.where(counts > 0, sums / counts, np.nan)
+        errs = np.where(counts > 0, np.sqrt(counts) / counts, np.nan)
+
+    bucket_months = (np.arange(first, first + num_buckets) * step) - 12 * 1970
+    starts = bucket_months.astype('datetime64[M]').astype('datetime64[D]')
+    return Buckets(starts, sums, counts, means, errs)
@@ -0,0 +1,16 @@
+import datetime as dt
+
+import angrymetalpy as amp
+
+if __name__ == '__main__':
+    print("Reading from JSON Lines, writing to JSON")
+    reviews = amp.read_reviews('tst.jsonl', fmt='jsonl')
+    with open('tst.json', 'w') as f:
+        f.write('# Generated {}\n'.format(dt.date.today().isoformat()))
+        for r in reviews:
+            f.write(r.json() + '\n')
+
+    print("Reading from JSON")
+    reviews = amp.reviews_from_json('tst.json')
+    for r in reviews[:10]:
+        print(r)
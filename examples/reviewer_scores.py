@@ -6,32 +6,27 @@ import angrymetalpy as amp
 
 
 if __name__ == '__main__':
-    reviews = amp.reviews_from_json('data_20180422.txt')
-    amg_reviewers = amp.reviewers_from_reviews(reviews)
+    table = amp.load_reviews('data_20180422.txt')
+    cube = amp.ReviewCube.from_table(table)
 
-    amg_reviewers = sorted(amg_reviewers, key=lambda x: len(x.reviews))
+    # reviewers from fewest to most reviews
+    per_reviewer = cube.rollup('author')
+    order = np.argsort(per_reviewer.counts, kind='mergesort')
+    reviewer_names = per_reviewer.labels('author')[order]
 
     fig = plt.figure()
     ax = fig.add_subplot(111)
 
-    min_date, max_date = amp.date_range(reviews)
-    n_months = amp.months_between(min_date, max_date)
+    min_date, max_date = amp.date_range(table)
 
-    xs = np.arange(start=0, stop=n_months, step=1)
     # timeline of reviewer activity
-    for i, reviewer in enumerate(amg_reviewers):
-        ys = np.zeros(n_months)
-        ys_counts = np.zeros(n_months)
-        for review in reviewer.reviews:
-            idx = amp.months_between(min_date, review.date)
-            ys[idx - 1] += review.score
-            ys_counts[idx - 1] += 1
-
-        idxs = np.where(ys_counts > 3)
-        ys[idxs] /= ys_counts[idxs]
-
-        if len(idxs[0]) > 1:
-            ax.plot(xs[idxs], ys[idxs], '.', label=reviewer.name)
+    for name in reviewer_names:
+        monthly = cube.slice(author=name).rollup('month')
+        busy = monthly.counts > 3
+
+        if busy.sum() > 1:
+            xs = amp.months_between(min_date, monthly.labels('month')[busy])
+            ax.plot(xs, monthly.means()[busy], '.', label=name)
 
     amp.set_month_axis(ax, min_date, max_date, step=12)
 
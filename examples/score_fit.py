@@ -1,14 +1,13 @@
 # do a time series analysis of AMG review score data
 #
-# - detrend time series using scipy optimize to do a linear fit
-# - plot acf of residuals
+# - detrend time series with a weighted linear fit
+# - plot acf of residuals, and look for seasonality in those of each genre
 # - look at fits to subsets of reviews by genre
 
 from datetime import datetime
 from matplotlib import gridspec
 import matplotlib.pyplot as plt
 from matplotlib.ticker import NullFormatter
-from scipy import optimize
 
 import numpy as np
 import angrymetalpy as amp
@@ -17,44 +16,34 @@ import angrymetalpy as amp
 def linear_model(p,x):
     return p[0] + x*p[1]
 
-def residual(p, x, y, err):
-    return (linear_model(p, x)-y)/err
-
 
 if __name__ == '__main__':
-    reviews = amp.reviews_from_json('data_20180422.txt')
-    min_date, max_date = amp.date_range(reviews)
+    table = amp.load_reviews('data_20180422.txt')
+    cube = amp.ReviewCube.from_table(table)
+    min_date, max_date = amp.date_range(table)
     num_months = amp.months_between(min_date, max_date) + 1
 
     # time series
     t = np.arange(start=0, stop=num_months, step=1)
-    scores = np.zeros(num_months)
-    counts = np.zeros(num_months)
-
-    for rev in reviews:
-        idx = amp.months_between(min_date, rev.date)
-        scores[idx] += rev.score
-        counts[idx] += 1
-
-    scores /= counts # average scores per month
-    scores_err = np.sqrt(counts) / counts
+    monthly = amp.bucket(table.dates, table.scores, start=min_date, end=max_date)
+    scores = monthly.means # average scores per month
+    scores_err = monthly.errs
 
-    min_idx = np.argmin(scores)
-    for rev in reviews:
-        idx = amp.months_between(min_date, rev.date)
-        if idx == min_idx:
-            print(rev.date)
-            print(rev.album, rev.artist, rev.score)
+    min_idx = np.nanargmin(scores)
+    month_idx = amp.month_index(table.dates, min_date)
+    for i in np.where(month_idx == min_idx)[0]:
+        rev = table[i]
+        print(rev.date)
+        print(rev.album, rev.artist, rev.score)
 
 
     # Figure 1: linear fit
-    p0 = [3., -0.005]
-    pf, cov, info, mesg, success = optimize.leastsq(residual, p0,
-                                         args=(t, scores, scores_err), full_output=1)
+    fit = amp.fit_linear_trends(scores, scores_err, t)
+    pf = [fit.intercept, fit.slope]
 
-    chisq = sum(info["fvec"]*info["fvec"])
-    dof = len(t)-len(pf)
-    pferr = [np.sqrt(cov[i,i]) for i in range(len(pf))]
+    chisq = fit.chisq
+    dof = fit.dof
+    pferr = [fit.intercept_err, fit.slope_err]
     global_fit = (pf[1], pferr[1])
 
     fig_fit = plt.figure(1, figsize=(5,4), dpi=100)#figsize=(7,5))
@@ -97,7 +86,11 @@ if __name__ == '__main__':
     fig_acf = plt.figure(3, figsize=(5,4), dpi=100)
     ax3 = fig_acf.add_subplot(111)
     ax3.set_xlim(-1, num_months)
-    ax3.acorr(residuals, maxlags=20)
+    acf = amp.autocorrelation(residuals, maxlags=20, demean=False)
+    ax3.vlines(acf.lags, 0, acf.acf)
+    ax3.plot(acf.lags, acf.acf, 'o')
+    ax3.axhline(0, color='k')
+    ax3.fill_between(acf.lags, -acf.conf, acf.conf, color='b', alpha=0.2, lw=0)
 
     ax3.set_xlim(-1, 20)
     ax3.set_ylim(-0.25, 1.05)
@@ -113,39 +106,26 @@ if __name__ == '__main__':
     genres = ['Death Metal', 'Black Metal', 'Doom Metal', 'Progressive Metal',
                 'Folk Metal', 'Thrash Metal', 'Heavy Metal', 'Hardcore',
                 'Power Metal', 'Hard Rock']
-    corrs = []
-    corr_err = []
-    total_counts = []
-
-    for genre in genres:
-        scores = np.zeros(num_months)
-        counts = np.zeros(num_months)
-
-        for rev in reviews:
-            if genre not in rev.tags:
-                continue
-            idx = amp.months_between(min_date, rev.date)
-            scores[idx] += rev.score
-            counts[idx] += 1
-
-        print('{} | {:.2f} +/- {:.2f}'.format(genre, sum(scores) / sum(counts), np.sqrt(sum(counts))/sum(counts)))
-        scores /= counts # average scores per month
-        scores_err = np.sqrt(counts) / counts
-
-        # prune out months with no reviews of this genre
-        _t = t[~np.isnan(scores)]
-        _scores = scores[~np.isnan(scores)]
-        _scores_err = scores_err[~np.isnan(scores)]
-
-        # now we fit the scores with a linear model
-        p0 = [3., 0.2]
-        pf, cov, info, mesg, success = optimize.leastsq(residual, p0,
-                                             args=(_t, _scores, _scores_err), full_output=1)
-        pferr = [np.sqrt(cov[i,i]) for i in range(len(pf))]
-
-        corrs.append(pf[1])
-        corr_err.append(pferr[1])
-        total_counts.append(sum(counts))
+    # monthly average scores of every genre, fitted together with a linear
+    # model. Months with no reviews of a genre are left out of its fit.
+    monthly = amp.monthly_series(cube.slice(tag=genres), 'tag', min_date, max_date)
+    fits = amp.fit_linear_trends(monthly.means, monthly.errs, t)
+    rows = [monthly.labels.index(genre) for genre in genres]
+
+    counts = monthly.counts.sum(axis=1)[rows]
+    for genre, total, count in zip(genres, monthly.sums.sum(axis=1)[rows], counts):
+        print('{} | {:.2f} +/- {:.2f}'.format(genre, total / count, np.sqrt(count) / count))
+
+    corrs = fits.slope[rows]
+    corr_err = fits.slope_err[rows]
+    total_counts = counts
+
+    # yearly seasonality of the residuals of each genre
+    genre_acf = amp.autocorrelation(monthly.means - amp.trend_values(fits, t), maxlags=12)
+    for genre, row in zip(genres, rows):
+        r12, band = genre_acf.acf[row, 12], genre_acf.conf[row, 12]
+        if abs(r12) > band:
+            print('{} residuals correlate at 12 months: {:.2f} (band {:.2f})'.format(genre, r12, band))
 
     zipped = sorted(zip(genres, corrs, corr_err, total_counts), key=lambda x: x[3], reverse=True)
     genres, corrs, corr_err, total_counts = zip(*zipped)
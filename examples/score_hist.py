@@ -7,17 +7,13 @@ import angrymetalpy as amp
 
 if __name__ == '__main__':
     reviews = amp.reviews_from_json('data_20180422.txt')
-    min_date, max_date = amp.date_range(reviews)
+    date_index = amp.DateIndex(reviews)
+    min_date, max_date = amp.date_range(date_index)
     num_months = amp.months_between(min_date, max_date) + 1
 
-    sc = []
-    sc_past = []
-    six_months_ago = dt.datetime.today() - dt.timedelta(6*365/12)
-
-    for rev in reviews:
-        sc.append(rev.score)
-        if rev.date > six_months_ago:
-            sc_past.append(rev.score)
+    sc = [rev.score for rev in reviews]
+    six_months_ago = dt.date.today() - dt.timedelta(6*365/12)
+    sc_past = [reviews[i].score for i in date_index.since(six_months_ago)]
 
     print(np.mean(sc), np.median(sc))
     fig_hist = plt.figure(figsize=(5,4), dpi=100)
@@ -9,6 +9,7 @@ import angrymetalpy as amp
 
 if __name__ == '__main__':
     reviews = amp.reviews_from_json('data_20180422.txt')
+    table = amp.ReviewTable.from_reviews(reviews)
     print(len(reviews))
     min_date, max_date = amp.date_range(reviews)
     num_months = amp.months_between(min_date, max_date) + 1
@@ -21,8 +22,9 @@ if __name__ == '__main__':
         idx = amp.months_between(min_date, rev.date)
         scores[idx] += rev.score
         counts[idx] += 1
-        if rev.score == 5.0:
-            perfect_albums[idx].append(rev.album)
+
+    for rev in table.where(score=5.0):
+        perfect_albums[amp.months_between(min_date, rev.date)].append(rev.album)
 
     scores /= counts # average scores per month
     score_unc = np.sqrt(counts) / counts
@@ -11,32 +11,33 @@ import angrymetalpy as amp
 
 
 if __name__ == '__main__':
-    reviews = amp.reviews_from_json('data_20180422.txt')
-    amg_reviewers = amp.reviewers_from_reviews(reviews)
+    table = amp.load_reviews('data_20180422.txt')
+    cube = amp.ReviewCube.from_table(table)
 
-    amg_reviewers = sorted(amg_reviewers, key=lambda x: len(x.reviews))
+    # reviewers from fewest to most reviews
+    per_reviewer = cube.rollup('author')
+    order = np.argsort(per_reviewer.counts, kind='mergesort')
+    reviewer_names = list(per_reviewer.labels('author')[order])
+    rows = dict((name, i) for i, name in enumerate(reviewer_names))
 
     fig = plt.figure(figsize=(5, 8), dpi=100)
     ax = fig.add_subplot(111)
 
-    min_date, max_date = amp.date_range(reviews)
+    min_date, max_date = amp.date_range(table)
     n_months = amp.months_between(min_date, max_date)
 
-    # timeline of reviewer activity
-    xs = []
-    ys = []
-    for i, reviewer in enumerate(amg_reviewers):
-        for review in reviewer.reviews:
-            xs.append(amp.months_between(min_date, review.date))
-            ys.append(i)
+    # timeline of reviewer activity, from the reviewer x month counts
+    monthly = cube.rollup('author', 'month')
+    xs = amp.months_between(min_date, monthly.labels('month'))
+    ys = [rows[name] for name in monthly.labels('author')]
 
     xbins = np.arange(0, n_months + 1, 1)
-    ybins = np.arange(0, len(amg_reviewers) + 1, 1)
-    ax.hist2d(xs, ys, bins=[xbins, ybins])
-    ax.set_ylim(0, len(amg_reviewers) - 0.5)
+    ybins = np.arange(0, len(reviewer_names) + 1, 1)
+    ax.hist2d(xs, ys, bins=[xbins, ybins], weights=monthly.counts)
+    ax.set_ylim(0, len(reviewer_names) - 0.5)
 
     # y axis should line up reviewer names with rows
-    ylabels = [x.name for x in amg_reviewers]
+    ylabels = reviewer_names
     ytickpos = ybins +  0.5
     ax.set_yticks(ytickpos)
     ax.set_yticklabels(ylabels)
@@ -0,0 +1,12 @@
+import angrymetalpy as amp
+
+if __name__ == '__main__':
+    print("Reading from JSON, writing to JSON Lines")
+    reviews = amp.reviews_from_json('data_20180422.txt')
+    count = amp.write_reviews('tst.jsonl', reviews, fmt='jsonl')
+    print("Wrote {} reviews".format(count))
+
+    print("Reading from JSON Lines, in parallel")
+    reviews = amp.read_reviews_parallel('tst.jsonl', fmt='jsonl')
+    for r in reviews[:10]:
+        print(r)
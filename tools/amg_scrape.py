@@ -4,15 +4,100 @@
 # Also included is an update function which stops when it finds a review that
 # is already in a file.
 
-from lxml import html
+from lxml import etree, html
 from lxml.etree import tostring
 from itertools import chain
+from multiprocessing import Pool
+from urlparse import urlparse
+import argparse
+import itertools
+import json
+import os
 import requests
 import sys
+import threading
+import time
 from datetime import datetime
 import re
+# strptime imports this lazily, which fails when first done from a thread
+import _strptime
 
 import angrymetalpy as amp
+from discovery import iter_feed, iter_sitemap, prefetch
+from fetch_control import FetchController, RetryQueue
+from http_cache import CacheMiss, ResponseCache
+from pipeline import DONE, BatchWriter, StageMetrics, bounded_queue, start_stage
+
+BASE_URL = 'http://www.angrymetalguy.com/'
+
+
+class RateLimiter(object):
+    """ Spaces out requests to the same host by at least 1 / rate seconds.
+        Safe to share between threads. A rate of None means no limit. """
+    def __init__(self, rate=None):
+        self._interval = 0. if rate is None else 1. / rate
+        self._next_time = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        if self._interval == 0.:
+            return
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next_time.get(host, now))
+            self._next_time[host] = start + self._interval
+        if start > now:
+            time.sleep(start - now)
+
+
+# HTTP session, rate limiter, fetch controller and optional response cache
+# shared by all fetches, so connections are pooled and kept alive. Replaced
+# by configure().
+_session = requests.Session()
+_limiter = RateLimiter()
+_controller = FetchController(1)
+_cache = None
+
+
+def configure(concurrency=1, rate=None, cache=None, max_retries=4,
+              retry_ratio=0.2, latency_target=None):
+    """ Set up the shared HTTP session for up to the given number of
+        concurrent fetches and the per-host rate limit in requests per
+        second. If a ResponseCache is given pages are fetched through it.
+        Failed requests are retried up to max_retries times, with retries
+        limited to about retry_ratio of all requests (see FetchController).
+        """
+    global _session, _limiter, _controller, _cache
+    _session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency,
+                                            pool_maxsize=concurrency)
+    _session.mount('http://', adapter)
+    _session.mount('https://', adapter)
+    _limiter = RateLimiter(rate)
+    _controller = FetchController(concurrency, max_retries=max_retries,
+                                  retry_ratio=retry_ratio,
+                                  latency_target=latency_target)
+    _cache = cache
+
+
+def _send(URL, headers=None, timeout=None):
+    _limiter.wait(URL)
+    return _session.get(URL, headers=headers, timeout=timeout)
+
+
+def _http_get(URL, headers=None, timeout=None):
+    """ GET a page through the shared session, respecting the rate limit and
+        retrying failures. Raises FetchFailed if the page could not be
+        fetched. """
+    return _controller.get(URL, _send, headers, timeout)
+
+
+def fetch(URL, timeout):
+    """ Return the body of the page at URL, from the cache if configured """
+    if _cache is not None:
+        return _cache.get(URL, _http_get, timeout)
+    return _http_get(URL, timeout=timeout).content
 
 
 def stringify_children(node):
@@ -24,9 +109,8 @@ def stringify_children(node):
     return ''.join(filter(None, parts))
 
 
-def get_review_url(start_page=1, end_page=None):
+def get_review_url(start_page=1, end_page=None, baseurl=BASE_URL):
     """ Returns a list of review page urls from AMG """
-    baseurl = 'http://www.angrymetalguy.com/' #category/reviews/'
     urllist = []
 
     if end_page is None:
@@ -39,155 +123,592 @@ def get_review_url(start_page=1, end_page=None):
         if i > 1:
             URL += 'page/' + str(i) + '/'
         try:
-            page = requests.get(URL, timeout=2.0)
-        except:
+            page = fetch(URL, timeout=10.0)
+        except CacheMiss:
+            # offline, the cached index pages have run out
+            break
+        except IOError:
             return None
 
         try:
-            tree = html.fromstring(page.content)
-        except:
+            tree = html.fromstring(page)
+        except (etree.ParserError, ValueError):
             return None
 
-        urls = tree.xpath('//a[@class="post-thumb img fix"]/@href')
+        urls = _xp_review_links(tree)
         for i in range(len(urls)):
             urllist.append(urls[i])
 
     return urllist
 
-def get_page_data(URL):
-    """ Scrape score from each review page """
-    try:
-    	page = requests.get(URL, timeout=10.0)
-    except:
-        return
+# XPath expressions and patterns used to parse pages, compiled once
+_xp_review_links = etree.XPath('//a[@class="post-thumb img fix"]/@href')
+_xp_title = etree.XPath('//title/text()')
+_xp_author = etree.XPath('//a[@rel="author"]/text()')
+_xp_date = etree.XPath('//time[@class="date time published updated sc"]/text()')
+_xp_tags = etree.XPath('//meta[@property="article:tag"]/@content')
+# score text box is almost always a <p> preceded by a horizontal rule,
+# but sometimes it's a div, and sometimes there is no horizontal rule, so we
+# look for center-justified text
+_xp_score_boxes = [
+    etree.XPath('//hr/following-sibling::p[1]'),
+    etree.XPath('//hr/following-sibling::div[1]'),
+    etree.XPath('//p[@style="text-align: center;"]'),
+]
+_re_tag_score = re.compile(r'(\d\.\d)')
+_re_rating = re.compile(r'(\d\.\d)\/5.0')
+# longest keywords first, so that "very good" is found before "good"
+_re_keyword = re.compile('|'.join(
+    re.escape(_) for _ in sorted(amp.site_score_mapping, key=len, reverse=True)),
+    flags=re.IGNORECASE)
+
+# How the score of a page was found, as reported by parse_review_page
+EXTRACTION_PATHS = ['tag', 'rating', 'keyword', 'none', 'skipped', 'invalid']
+
+
+def _find_score(tree, taglist):
+    """ Return the score string of a review page and how it was found """
+    scorestr = ''
+    for tag in taglist:
+        score_search = _re_tag_score.search(tag)
+        if score_search is not None:
+            scorestr = score_search.group(1)
+    if scorestr != '':
+        return scorestr, 'tag'
 
+    # if score not in the tag, find it the old fashioned way
+    for xp in _xp_score_boxes:
+        boxes = xp(tree)
+        if boxes:
+            scorep = stringify_children(boxes[0])
+            break
+    else:
+        # otherwise we got nothing
+        return '-1', 'none'
+
+    score_search = _re_rating.search(scorep)
+    if score_search is not None:
+        return score_search.group(1), 'rating'
+
+    # try to see if any line in the <p> contains an AMG score keyword that
+    # we can convert to a score
+    for elem in scorep.split('<br/>'):
+        elem = elem.strip().split('!')[0] # some cleanup of the string...
+        score_search = _re_keyword.search(elem)
+        if score_search is not None:
+            return str(amp.site_score_mapping[score_search.group(0).lower()]), 'keyword'
+
+    return '', 'none'
+
+
+def parse_review_page(page, URL):
+    """
+    Parse the HTML of a review page into a review. Returns the review and
+    the extraction path naming how the score was found (see
+    EXTRACTION_PATHS). The review is None for "things you might have
+    missed" posts ('skipped') and pages without author or date ('invalid').
+    Missing album/artist or score are left empty or -1 in the review.
+    """
     try:
-        tree = html.fromstring(page.content)
-    except:
-        return
+        tree = html.fromstring(page)
+    except (etree.ParserError, ValueError):
+        return None, 'invalid'
 
     # some reviews use the unicode '-' character, u2013, so we have to replace it before splitting
     try:
-        album_artist = tree.xpath('//title/text()')[0].strip().replace(u'\u2013', '-').split(' Review')[0]
+        album_artist = _xp_title(tree)[0].strip().replace(u'\u2013', '-').split(' Review')[0]
         artist = album_artist.split(' - ')[0]
         album = album_artist.split(' - ')[1]
-    except:
-        with open('log.txt', 'a') as f:
-            f.write('Could not get album/artist info from {}\n'.format(URL))
+    except IndexError:
         artist = ''
         album = ''
 
-    author = tree.xpath('//a[@rel="author"]/text()')[0] # name of reviewer
-    date = tree.xpath('//time[@class="date time published updated sc"]/text()')[0] # date of review
-    date_as_obj =  datetime.strptime(date, "%B %d, %Y")
-    taglist = tree.xpath('//meta[@property="article:tag"]/@content') # all tag fields
-
-    scorep = None
-    scorestr = ''
-
-    # try to find score, or skip things you might have missed reviews
+    try:
+        author = _xp_author(tree)[0] # name of reviewer
+        date = _xp_date(tree)[0] # date of review
+        date_as_obj = datetime.strptime(date, "%B %d, %Y")
+    except (IndexError, ValueError):
+        return None, 'invalid'
+    taglist = _xp_tags(tree) # all tag fields
+
+    # skip things you might have missed reviews
     for tag in taglist:
-        score_search = re.search('(\d\.\d)', tag)
-        if score_search is not None:
-            scorestr = score_search.group(0)
-
         if 'things you might have missed' in tag.lower():
-            return None
-
-    # if score not in the tag, find it the old fashioned way
-    if scorestr == '':
-        # score text box is almost always a <p> preceded by a horizontal rule
-        try:
-            scorep = stringify_children(tree.xpath("//hr/following-sibling::p[1]")[0])
-        except IndexError:
-            # ... but sometimes it's a div
-            try:
-                scorep = stringify_children(tree.xpath("//hr/following-sibling::div[1]")[0])
-            except IndexError:
-                # ... and sometimes there is no horizontal rule, so we look for center-justified text
-                try:
-                    scorep = stringify_children(tree.xpath('//p[@style="text-align: center;"]')[0])
-                except IndexError:
-                    # otherwise we got nothing
-                    scorestr = '-1'
-
-        if scorep is not None:
-            score_search = re.search('(\d\.\d\/5.0)', scorep)
-            if score_search is not None:
-                scorestr = score_search.group(0).split('/5.0')[0]
-            else:
-                # try to see if any line in the <p> contains an AMG score keyword that
-                # we can convert to a score
-                scorep = scorep.split('<br/>')
-                scorestr = ''
-                for elem in scorep:
-                    elem = elem.strip().split('!')[0] # some cleanup of the string...
-                    for keyword in amp.site_score_mapping.keys():
-                        # technically this section is incorrect because "good" will also find "very good"
-                        # however the key list has "very good" first, so it should break before checking "good"
-                        score_search = re.search(keyword, elem, flags=re.IGNORECASE)
-                        if score_search is not None:
-                            scorestr = str(amp.site_score_mapping[score_search.group(0).lower()])
-                            break
-
-                    if scorestr != '':
-                        break
+            return None, 'skipped'
 
+    scorestr, path = _find_score(tree, taglist)
     try:
         score = float(scorestr)
-    except:
-        with open('log.txt', 'a') as f:
-            f.write('Could not get score from {}\n'.format(URL))
+    except ValueError:
         score = -1
 
+    # metal bands use unicode characters
+    album, artist, author = (_.encode('utf-8') for _ in [album, artist, author])
+    return amp.Review(album, artist, author, date_as_obj, taglist, score, ''), path
+
+
+def get_page_data(URL):
+    """ Scrape score from each review page """
     try:
-        # metal bands use unicode characters
-        album, artist, author = (_.encode('utf-8') for _ in [album, artist, author])
-        review = amp.Review(album, artist, author, date_as_obj, taglist, score, '')
-        return review
-    except UnicodeEncodeError:
-        print('Unicode error: {}'.format(URL))
+        page = fetch(URL, timeout=10.0)
+    except IOError:
+        return
+
+    review, path = parse_review_page(page, URL)
+    if review is not None:
+        _log_problems(review, URL)
+    return review
 
 
-def update(prev_file='', max_page=None):
+def _log_problems(review, URL):
+    """ Note fields that could not be found in log.txt """
+    if review.album == '':
+        with open('log.txt', 'a') as f:
+            f.write('Could not get album/artist info from {}\n'.format(URL))
+    if review.score == -1:
+        with open('log.txt', 'a') as f:
+            f.write('Could not get score from {}\n'.format(URL))
+
+
+def _is_post_sitemap(url):
+    """ True for sitemaps listing posts, in WordPress or Yoast naming """
+    name = url.rstrip('/').split('/')[-1]
+    return name.startswith('wp-sitemap-posts-post') or name.startswith('post-sitemap')
+
+
+def _review_key(rev):
+    """ Content identity of a review: artist, album and date. None if the
+        title could not be split into artist and album, as many different
+        pages would then share a key. """
+    if rev.artist == '' or rev.album == '':
+        return None
+    artist, album = (_.decode('utf-8') if isinstance(_, str) else _
+                     for _ in [rev.artist, rev.album])
+    return (artist, album, datetime.strftime(rev.date, '%Y-%m-%d'))
+
+
+class ScrapeCheckpoint(object):
+    """
+    Progress of a scrape into a data file, kept in an append-only journal
+    next to it: the last completed index page and the URLs and
+    (artist, album, date) keys of the reviews already written. Reviews are
+    identified by URL. The keys recognise reviews that were in the data file
+    before its first scrape, whose URLs are unknown. Lookups are set
+    operations, and an interrupted run resumes after the last completed
+    index page.
+    """
+    def __init__(self, path):
+        self._path = path
+        self._urls = set()
+        self._keys = {} # review key -> url, if known
+        self._last_page = 0
+        self._last_finished = None
+        self._exists = os.path.exists(path)
+
+        if self._exists:
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # partly written last line of an interrupted run
+                        continue
+                    self._replay(entry)
+
+    def _replay(self, entry):
+        if entry[0] == 'review':
+            key = None if entry[2] is None else tuple(entry[2])
+            if entry[1] is not None:
+                self._urls.add(entry[1])
+                if key is not None:
+                    self._keys[key] = entry[1]
+            elif key is not None:
+                self._keys.setdefault(key, None)
+        elif entry[0] == 'page':
+            self._last_page = entry[1]
+        elif entry[0] == 'done':
+            self._last_page = 0
+            if len(entry) > 1:
+                self._last_finished = entry[1]
+
+    def _append(self, entries):
+        with open(self._path, 'a') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + '\n')
+        for entry in entries:
+            self._replay(entry)
+        self._exists = True
+
+    @property
+    def exists(self):
+        return self._exists
+
+    @property
+    def last_finished(self):
+        """ Time the last complete scrape finished, or None """
+        return self._last_finished
+
+    @property
+    def next_page(self):
+        """ Index page to start scraping from """
+        return self._last_page + 1
+
+    def seen_url(self, url):
+        return url in self._urls
+
+    def seen(self, rev, url=None):
+        """ True if the review at url, or one with the same artist, album
+            and date, was written before """
+        if url is not None and url in self._urls:
+            return True
+        key = _review_key(rev)
+        return key is not None and key in self._keys
+
+    def seed(self, rev_list):
+        """ Record reviews already in the data file, whose URLs are unknown.
+            Those without artist and album cannot be recognised later. """
+        keys = [_review_key(rev) for rev in rev_list]
+        self._append([['review', None, key] for key in keys if key is not None])
+
+    def page_done(self, page, written):
+        """ Record a completed index page and the (url, review) pairs written
+            to the data file for it, or found to be in it already. A review
+            of None marks a page that was fetched but holds no review. """
+        entries = [['review', url, None if rev is None else _review_key(rev)]
+                   for url, rev in written]
+        self._append(entries + [['page', page]])
+
+    def finish(self):
+        """ Mark the scrape complete, so the next run starts from page 1.
+            The journal is compacted to just the seen reviews. """
+        tmp_name = self._path + '.tmp'
+        with open(tmp_name, 'w') as f:
+            for key, url in self._keys.items():
+                f.write(json.dumps(['review', url, key]) + '\n')
+            for url in self._urls - set(self._keys.values()):
+                f.write(json.dumps(['review', url, None]) + '\n')
+            self._last_finished = time.time()
+            f.write(json.dumps(['done', self._last_finished]) + '\n')
+        os.rename(tmp_name, self._path)
+        self._last_page = 0
+
+
+def update(prev_file='', max_page=None, concurrency=1, rate=None,
+           baseurl=BASE_URL, cache=None, parse_workers=0, queue_size=64,
+           flush_every=100, fsync='page', discovery='index', listing_url=None,
+           max_retries=4, retry_ratio=0.2, latency_target=None):
     """ Scrape data. If a filename is specified, only scrape until the program
-        encounters a review already in the file. """
-    if prev_file != '':
-        reviews = amp.reviews_from_csv(prev_file)
-        review_titles = [_.album for _ in reviews]
-
-    filename = 'data_{}.txt'.format(
-        datetime.strftime(datetime.now(), format='%Y%m%d')) if prev_file == '' else prev_file
-
-    with open(filename, 'a') as f:
-
-        page_count = 1
-        found_end = False
-        while not found_end:
-            urls = get_review_url(start_page=page_count)
-            print('found {} reviews on page {}'.format(len(urls), page_count))
-
-            for url in urls:
-                rev = get_page_data(url)
-                if rev is not None:
-                    if prev_file != '':
-                        # check if this review was already in prev_file
-                        if rev.album in review_titles:
+        encounters a review already in the file. Review pages are fetched
+        with up to concurrency requests in flight, at most rate requests per
+        second. If a ResponseCache is given pages are fetched through it.
+        Failed fetches are retried as set up by configure(), and URLs that
+        still fail are added to a retry queue next to the data file.
+
+        Index page discovery, fetching, parsing and writing run as a pipeline
+        connected by queues of at most queue_size items. Pages are parsed by
+        parse_workers processes, or in the fetching process if 0. A single
+        writer writes reviews in page order in batches of flush_every lines,
+        and fsyncs the file after each index page ('page'), each batch
+        ('batch') or never ('never').
+
+        discovery selects how review urls are found: from the paginated
+        index pages ('index'), the WordPress sitemap ('sitemap') or the RSS
+        feed ('feed'), read from listing_url (by default the standard
+        location under baseurl), or the retry queue ('retry'). From sitemaps
+        and feeds only the pages no earlier run has seen are fetched, in
+        batches of 10 counted as pages. """
+    configure(concurrency, rate, cache, max_retries, retry_ratio, latency_target)
+
+    try:
+        filename = 'data_{}.txt'.format(
+            datetime.strftime(datetime.now(), format='%Y%m%d')) if prev_file == '' else prev_file
+
+        checkpoint = ScrapeCheckpoint(filename + '.checkpoint')
+        retry_queue = RetryQueue(filename + '.retry')
+        if prev_file != '' and not checkpoint.exists:
+            # first update of this file, record what is already in it
+            checkpoint.seed(amp.reviews_from_csv(prev_file))
+
+        # started before any thread, so the workers are forked from a quiet process
+        parse_pool = Pool(parse_workers) if parse_workers > 0 else None
+
+        stop = threading.Event()
+        fetch_queue = bounded_queue(queue_size)
+        parse_queue = bounded_queue(queue_size)
+        write_queue = bounded_queue(queue_size)
+
+        def index_pages():
+            """ (page number, new urls) of each index page, prefetching the
+                following index pages """
+            if max_page is None:
+                numbers = itertools.count(checkpoint.next_page)
+            else:
+                numbers = range(checkpoint.next_page, max_page + 1)
+            get_page = lambda n: (n, get_review_url(start_page=n, baseurl=baseurl))
+
+            for page_count, urls in prefetch(get_page, numbers):
+                if urls is None:
+                    raise IOError('Could not get index page {}'.format(page_count))
+                if not urls:
+                    # ran out of index pages
+                    return
+                print('found {} reviews on page {}'.format(len(urls), page_count))
+
+                new_urls = [_ for _ in urls if not checkpoint.seen_url(_)]
+                yield page_count, new_urls
+                if len(new_urls) < len(urls) and prev_file != '':
+                    # reached reviews written by an earlier run
+                    return
+
+        def listed_pages(entries):
+            """ Batches of the urls from a sitemap or feed that no earlier
+                run has seen. The data file is append-only, so pages changed
+                since (a newer lastmod) are not fetched again. """
+            batch = []
+            page_count = 1
+            for url, lastmod in entries:
+                if checkpoint.seen_url(url):
+                    continue
+                batch.append(url)
+                if len(batch) == 10:
+                    yield page_count, batch
+                    page_count += 1
+                    batch = []
+                    if max_page is not None and page_count > max_page:
+                        return
+            if batch:
+                yield page_count, batch
+
+        fetch_listing = lambda url: fetch(url, timeout=10.0)
+        if discovery == 'index':
+            pages = index_pages()
+            first_page = checkpoint.next_page
+        elif discovery == 'sitemap':
+            pages = listed_pages(iter_sitemap(fetch_listing,
+                listing_url or baseurl + 'wp-sitemap.xml', accept=_is_post_sitemap))
+            first_page = 1
+        elif discovery == 'feed':
+            pages = listed_pages(iter_feed(fetch_listing, listing_url or baseurl + 'feed/'))
+            first_page = 1
+        elif discovery == 'retry':
+            pages = listed_pages((url, None) for url in retry_queue.urls())
+            first_page = 1
+        else:
+            raise ValueError('Unknown discovery {!r}'.format(discovery))
+        # only the index pages run from newest to oldest, so that an update can
+        # stop at the first review it has seen before
+        stop_at_seen = prev_file != '' and discovery == 'index'
+
+        discover_metrics = StageMetrics('discover')
+        discover_errors = []
+
+        def discover():
+            """ Queue the new review urls of each page, and tell the writer how
+                many to expect per page """
+            pages_iter = iter(pages)
+            try:
+                while not stop.is_set():
+                    start = time.time()
+                    try:
+                        page_count, new_urls = next(pages_iter)
+                    except StopIteration:
+                        break
+                    discover_metrics.record(time.time() - start)
+
+                    write_queue.put(('page', page_count, len(new_urls)))
+                    for i, url in enumerate(new_urls):
+                        fetch_queue.put((page_count, i, url))
+            except Exception as e:
+                # let the pipeline drain, then fail without finishing the
+                # checkpoint so the next run resumes
+                discover_errors.append(e)
+            finally:
+                discover_metrics.finish()
+                fetch_queue.put(DONE)
+
+        def fetch_page(item):
+            page_count, i, url = item
+            body = None
+            if not stop.is_set():
+                try:
+                    body = fetch(url, timeout=10.0)
+                except Exception as e:
+                    retry_queue.add(url, str(e))
+                else:
+                    retry_queue.remove(url)
+            return [(page_count, i, url, body)]
+
+        def parse_page(item):
+            page_count, i, url, body = item
+            review, path = None, None
+            if body is not None:
+                if parse_pool is not None:
+                    review, path = parse_pool.apply(parse_review_page, (body, url))
+                else:
+                    review, path = parse_review_page(body, url)
+                if review is not None:
+                    _log_problems(review, url)
+            return [(page_count, i, url, review, path)]
+
+        # a stage that fails stops discovery and drops the rest of its input,
+        # so the writer still gets to the end
+        fetch_metrics = start_stage('fetch', fetch_page, fetch_queue, parse_queue,
+                                    concurrency, stop)
+        parse_metrics = start_stage('parse', parse_page, parse_queue, write_queue,
+                                    max(parse_workers, 1), stop)
+        producer = threading.Thread(target=discover, name='discover')
+        producer.daemon = True
+        producer.start()
+
+        # the writer puts results back in page order, so the file order is the
+        # same whatever the concurrency
+        write_metrics = StageMetrics('write', write_queue)
+        page_sizes = {}
+        pending = {}
+        page_count = first_page
+        end_page = None
+        num_pages = 0
+
+        with open(filename, 'a') as f:
+            writer = BatchWriter(f, flush_every, fsync)
+            while True:
+                write_metrics.sample_queue()
+                item = write_queue.get()
+                if item is DONE:
+                    break
+                if item[0] == 'page':
+                    page_sizes[item[1]] = item[2]
+                    pending.setdefault(item[1], {})
+                else:
+                    pending.setdefault(item[0], {})[item[1]] = item[2:]
+
+                # write out every complete page that is next in order
+                while page_count in page_sizes and \
+                        len(pending[page_count]) == page_sizes[page_count]:
+                    results = pending.pop(page_count)
+                    num_urls = page_sizes.pop(page_count)
+                    if end_page is not None:
+                        # pages fetched past the end of an update are dropped
+                        page_count += 1
+                        continue
+
+                    start = time.time()
+                    written = []
+                    for i in range(num_urls):
+                        url, rev, path = results[i]
+                        if rev is None:
+                            if path is not None and not checkpoint.seen_url(url):
+                                # fetched but skipped or invalid, remember its
+                                # url so it is not fetched again
+                                written.append((url, None))
+                            continue
+                        if end_page is not None and _review_key(rev) is None:
+                            # past the reviews of an earlier run, where one
+                            # without artist and album cannot be told apart;
+                            # remember its url, so it is not fetched again
+                            written.append((url, rev))
+                            continue
+                        # check if this review was already written
+                        if checkpoint.seen(rev, url):
                             # if yes, don't write it and mark this page as the end
-                            found_end = True
+                            if stop_at_seen:
+                                end_page = page_count
+                                stop.set()
+                            if not checkpoint.seen_url(url):
+                                # remember its url, so it is not fetched again
+                                written.append((url, rev))
                             continue
 
-                    # else write to the file
-                    #print('writing {}'.format(rev.album))
-                    f.write(rev.csv().encode('utf-8') + '\n')
-
-            page_count += 1
-            if max_page is not None:
-                if page_count > max_page:
-                    found_end = True
+                        # else write to the file
+                        writer.write(rev.csv().encode('utf-8') + '\n')
+                        written.append((url, rev))
+
+                    # the data has to reach the file before the checkpoint says so
+                    writer.end_page()
+                    checkpoint.page_done(page_count, written)
+                    write_metrics.record(time.time() - start)
+
+                    num_pages += num_urls
+                    elapsed = time.time() - write_metrics.start
+                    print('{} pages in {:.1f}s ({:.2f} pages/s)'.format(
+                        num_pages, elapsed, num_pages / elapsed))
+                    page_count += 1
+
+            writer.flush()
+        write_metrics.finish()
+
+        producer.join()
+        if parse_pool is not None:
+            parse_pool.close()
+            parse_pool.join()
+
+        for metrics in [discover_metrics, fetch_metrics, parse_metrics, write_metrics]:
+            print(metrics)
+        print(_controller)
+        retry_queue.save()
+        if len(retry_queue) > 0:
+            print('{} urls failed, run with --discovery retry to try them again'.format(
+                len(retry_queue)))
+
+        # fail without finishing the checkpoint, so the next run resumes
+        errors = discover_errors + fetch_metrics.errors + parse_metrics.errors
+        if errors:
+            raise errors[0]
+        checkpoint.finish()
+    finally:
+        # the index of the pages fetched so far, even if the run failed
+        if cache is not None:
+            cache.save()
 
 if __name__ == '__main__':
-    if len(sys.argv) > 1:
-        update(sys.argv[1])
-    else:
-        update()
+    parser = argparse.ArgumentParser(description='Scrape reviews from AMG')
+    parser.add_argument('prev_file', nargs='?', default='',
+                        help='data file to update with new reviews')
+    parser.add_argument('--max-page', type=int, default=None,
+                        help='last index page to scrape')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='number of review pages fetched at once')
+    parser.add_argument('--rate', type=float, default=None,
+                        help='maximum requests per second to the site')
+    parser.add_argument('--base-url', default=BASE_URL,
+                        help='site to scrape, e.g. a local stand-in server')
+    parser.add_argument('--cache-dir', default=None,
+                        help='keep fetched pages in this directory')
+    parser.add_argument('--cache-ttl', type=float, default=3600.,
+                        help='seconds before cached pages are revalidated')
+    parser.add_argument('--cache-size', type=float, default=1024.,
+                        help='maximum size of the page cache in MB')
+    parser.add_argument('--offline', action='store_true',
+                        help='only use cached pages, never the network')
+    parser.add_argument('--discovery', choices=['index', 'sitemap', 'feed', 'retry'],
+                        default='index', help='how to find review pages')
+    parser.add_argument('--listing-url', default=None,
+                        help='sitemap or feed url, if not the standard one')
+    parser.add_argument('--max-retries', type=int, default=4,
+                        help='times a failed request is retried')
+    parser.add_argument('--retry-budget', type=float, default=0.2,
+                        help='retries allowed per request, on average')
+    parser.add_argument('--latency-target', type=float, default=None,
+                        help='seconds per request above which concurrency is reduced')
+    parser.add_argument('--parse-workers', type=int, default=0,
+                        help='number of processes parsing pages')
+    parser.add_argument('--queue-size', type=int, default=64,
+                        help='maximum number of items waiting between stages')
+    parser.add_argument('--flush-every', type=int, default=100,
+                        help='number of reviews written to the file at once')
+    parser.add_argument('--fsync', choices=['never', 'page', 'batch'],
+                        default='page', help='when to fsync the data file')
+    args = parser.parse_args()
+
+    cache = None
+    if args.cache_dir is not None:
+        cache = ResponseCache(args.cache_dir, ttl=args.cache_ttl,
+                              max_bytes=int(args.cache_size * (1 << 20)),
+                              offline=args.offline)
+    elif args.offline:
+        parser.error('--offline needs --cache-dir')
+
+    update(args.prev_file, args.max_page, args.concurrency, args.rate,
+           args.base_url, cache, args.parse_workers, args.queue_size,
+           args.flush_every, args.fsync, args.discovery, args.listing_url,
+           args.max_retries, args.retry_budget, args.latency_target)
@@ -0,0 +1,74 @@
+# Measure the time taken by `import angrymetalpy` in fresh interpreters and
+# check that it does not load heavy dependencies. Exits with status 1 if the
+# best time is over the budget or NumPy, SciPy or matplotlib were imported,
+# so it can guard against import time regressions. On Python 3.7 and later
+# the slowest imports are listed from python -X importtime.
+#
+# usage: python bench_import.py [repeats] [budget_ms]
+
+import os
+import subprocess
+import sys
+
+HEAVY_MODULES = ['numpy', 'scipy', 'matplotlib', 'multiprocessing', 'lxml']
+
+_probe = '''
+import sys, time
+start = time.time()
+import angrymetalpy
+elapsed = time.time() - start
+print(elapsed)
+print(' '.join(_ for _ in {heavy!r} if _ in sys.modules))
+'''.format(heavy=HEAVY_MODULES)
+
+
+def import_time():
+    """ Seconds taken by importing the package in a new interpreter, and
+        the heavy modules it loaded """
+    output = subprocess.check_output([sys.executable, '-c', _probe],
+                                     universal_newlines=True)
+    lines = output.split('\n')
+    return float(lines[0]), lines[1].split()
+
+
+def slowest_imports(count=10):
+    """ (microseconds, module) of the slowest imports, cumulative times
+        from python -X importtime """
+    process = subprocess.Popen([sys.executable, '-X', 'importtime', '-c',
+                                'import angrymetalpy'],
+                               stderr=subprocess.PIPE, universal_newlines=True)
+    times = []
+    for line in process.communicate()[1].split('\n'):
+        fields = line.split('|')
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            times.append((int(fields[1]), fields[2].rstrip()))
+    return sorted(times, reverse=True)[:count]
+
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    budget = float(sys.argv[2]) / 1e3 if len(sys.argv) > 2 else 0.1
+
+    # import the package from this checkout
+    os.environ['PYTHONPATH'] = os.pathsep.join(
+        [os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')] +
+        [_ for _ in [os.environ.get('PYTHONPATH')] if _])
+
+    results = [import_time() for _ in range(repeats)]
+    best = min(_[0] for _ in results)
+    heavy = sorted(set(_ for result in results for _ in result[1]))
+    print('import angrymetalpy: best {:.1f} ms of {}'.format(best * 1e3, repeats))
+
+    if sys.version_info >= (3, 7):
+        print('slowest imports (cumulative us):')
+        for usec, module in slowest_imports():
+            print('{:>10} {}'.format(usec, module))
+
+    failed = False
+    if heavy:
+        print('FAIL: importing loads {}'.format(', '.join(heavy)))
+        failed = True
+    if best > budget:
+        print('FAIL: over the budget of {:.0f} ms'.format(budget * 1e3))
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,79 @@
+# Benchmark writing and reading review files, comparing the per-review
+# paths (Review.csv, Review.from_csv, Review.json and reviews_from_json)
+# with the single pass write_reviews and read_reviews.
+#
+# usage: python bench_io.py [data_file] [repeats]
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import angrymetalpy as amp
+
+
+def per_line_write_csv(fname, reviews):
+    with open(fname, 'w') as f:
+        for rev in reviews:
+            f.write(rev.csv().encode('utf-8') + '\n')
+
+def per_line_read_csv(fname):
+    reviews = []
+    with open(fname, 'r') as f:
+        for line in f:
+            try:
+                rev = Review_from_csv(line)
+            except ValueError:
+                # lines with no tags are not understood by Review.from_csv
+                continue
+            if rev.is_valid():
+                reviews.append(rev)
+    return reviews
+
+Review_from_csv = amp.Review.from_csv
+
+def per_review_write_json(fname, reviews):
+    with open(fname, 'w') as f:
+        for rev in reviews:
+            f.write(rev.json() + '\n')
+
+
+def best_time(func, args, repeats):
+    """ Lowest wall time of repeats calls of func(*args), and its result """
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        result = func(*args)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+if __name__ == '__main__':
+    fname = sys.argv[1] if len(sys.argv) > 1 else '../examples/data_20180422.txt'
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    reviews = amp.reviews_from_json(fname)
+    tmp_dir = tempfile.mkdtemp()
+    path = lambda name: os.path.join(tmp_dir, name)
+
+    try:
+        cases = [
+            ('write csv', 'per line', per_line_write_csv, (path('a.csv'), reviews)),
+            ('write csv', 'bulk', amp.write_reviews, (path('b.csv'), reviews, 'csv')),
+            ('read csv', 'per line', per_line_read_csv, (path('a.csv'),)),
+            ('read csv', 'bulk', amp.read_reviews, (path('b.csv'), 'csv')),
+            ('write json', 'per review', per_review_write_json, (path('a.json'), reviews)),
+            ('write json', 'jsonl', amp.write_reviews, (path('b.jsonl'), reviews, 'jsonl')),
+            ('read json', 'per review', amp.reviews_from_json, (path('a.json'),)),
+            ('read json', 'jsonl', amp.read_reviews, (path('b.jsonl'), 'jsonl')),
+        ]
+
+        print('{} reviews, best of {}'.format(len(reviews), repeats))
+        print('{:>12} {:>12} {:>10} {:>14}'.format('task', 'path', 'ms', 'reviews/s'))
+        for task, name, func, args in cases:
+            elapsed, result = best_time(func, args, repeats)
+            print('{:>12} {:>12} {:>10.1f} {:>14.0f}'.format(
+                task, name, elapsed * 1e3, len(reviews) / elapsed))
+    finally:
+        shutil.rmtree(tmp_dir)
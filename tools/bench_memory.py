@@ -0,0 +1,46 @@
+# Measure the memory used per review object after loading a data file.
+#
+# Every object reachable from the loaded reviews is counted once, so strings
+# shared between reviews only count once. The shared string and tag tables
+# of the library are included when present.
+#
+# usage: python bench_memory.py [data_file]
+
+import gc
+import sys
+import types
+
+import angrymetalpy as amp
+import angrymetalpy.angrymetalpy as amp_core
+
+_skip_types = (type, types.ModuleType, types.FunctionType,
+               types.BuiltinFunctionType)
+
+
+def deep_size(roots):
+    """ Total size in bytes of all objects reachable from roots """
+    seen = set()
+    total = 0
+    stack = list(roots)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _skip_types):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return total
+
+
+if __name__ == '__main__':
+    fname = sys.argv[1] if len(sys.argv) > 1 else '../examples/data_20180422.txt'
+    reviews = amp.reviews_from_json(fname)
+
+    shared = [getattr(amp_core, _, None) for _ in ('_artists', '_authors', '_tag_names', '_tag_ids')]
+    shared = [_ for _ in shared if _ is not None]
+
+    reviews_size = deep_size([reviews] + shared)
+    list_size = sys.getsizeof(reviews)
+    print('{} reviews'.format(len(reviews)))
+    print('total: {:.1f} kB'.format(reviews_size / 1024.))
+    print('bytes per review: {:.0f}'.format(float(reviews_size - list_size) / len(reviews)))
@@ -0,0 +1,34 @@
+# Benchmark parallel loading of a CSV or JSON Lines review file into a
+# ReviewTable with increasing numbers of worker processes.
+#
+# usage: python bench_parallel.py data_file.jsonl [max_processes]
+
+import multiprocessing
+import sys
+import time
+
+import angrymetalpy as amp
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('usage: python bench_parallel.py data_file.jsonl [max_processes]')
+        sys.exit(1)
+    fname = sys.argv[1]
+    fmt = 'csv' if fname.endswith('.csv') else 'jsonl'
+    max_processes = int(sys.argv[2]) if len(sys.argv) > 2 else multiprocessing.cpu_count()
+
+    start = time.time()
+    table = amp.ReviewTable.from_reviews(amp.read_reviews(fname, fmt))
+    serial = time.time() - start
+    print('{} reviews'.format(len(table)))
+    print('{:>10} {:>10} {:>10}'.format('processes', 's', 'speedup'))
+    print('{:>10} {:>10.2f} {:>10.2f}'.format('serial', serial, 1.))
+
+    processes = 1
+    while processes <= max_processes:
+        start = time.time()
+        table = amp.read_table_parallel(fname, fmt, processes)
+        elapsed = time.time() - start
+        print('{:>10} {:>10.2f} {:>10.2f}'.format(processes, elapsed, serial / elapsed))
+        processes *= 2
@@ -0,0 +1,58 @@
+# Benchmark review page parsing over a directory of saved pages.
+#
+# Every file under the directory is parsed with parse_review_page. Pages are
+# grouped by the path used to extract the score, and the parse rate of each
+# group is reported.
+#
+# usage: python bench_parse.py saved_pages_dir [repeats]
+
+import os
+import sys
+import time
+
+from amg_scrape import parse_review_page, EXTRACTION_PATHS
+
+
+def load_pages(root):
+    """ Return (path, contents) of every file under root """
+    pages = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in sorted(filenames):
+            fname = os.path.join(dirpath, name)
+            with open(fname, 'rb') as f:
+                pages.append((fname, f.read()))
+    return pages
+
+
+def bench(pages, repeats=1):
+    """ Parse all pages repeats times, returning the number of pages and the
+        total parse time for each extraction path """
+    counts = dict((_, 0) for _ in EXTRACTION_PATHS)
+    times = dict((_, 0.) for _ in EXTRACTION_PATHS)
+    for _ in range(repeats):
+        for fname, page in pages:
+            start = time.time()
+            review, path = parse_review_page(page, fname)
+            times[path] += time.time() - start
+            counts[path] += 1
+    return counts, times
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('usage: python bench_parse.py saved_pages_dir [repeats]')
+        sys.exit(1)
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+    pages = load_pages(sys.argv[1])
+    counts, times = bench(pages, repeats)
+
+    print('{:>10} {:>8} {:>12}'.format('path', 'pages', 'pages/s'))
+    for path in EXTRACTION_PATHS:
+        if counts[path] > 0:
+            print('{:>10} {:>8} {:>12.1f}'.format(
+                path, counts[path] / repeats, counts[path] / times[path]))
+    total_time = sum(times.values())
+    if total_time > 0:
+        print('{:>10} {:>8} {:>12.1f}'.format(
+            'all', len(pages), sum(counts.values()) / total_time))
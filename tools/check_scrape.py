@@ -0,0 +1,202 @@
+# Check the scraper end to end against the fixture site in fixtures/site,
+# served by fake_site on a free local port. Runs update() in each discovery
+# mode and checks the rows written to the data file against the reviews
+# parsed straight from the fixture pages:
+#
+# - full: a fresh scrape of the index pages writes every review, in order
+# - faults: the same through a slow, flaky and throttling site
+# - update: an update of a data file missing the newest reviews appends
+#   just those, and a second update appends nothing
+# - sitemap: a fresh scrape from the sitemap writes every review, and a
+#   second one fetches no pages
+# - feed: a fresh scrape from the feed writes the reviews it lists, and a
+#   second one fetches no pages
+#
+# Exits with status 1 if any check fails.
+#
+# usage: python check_scrape.py
+
+import contextlib
+import glob
+import os
+import shutil
+import sys
+import tempfile
+
+import amg_scrape
+import fake_site
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'site')
+FIXTURE_URL = b'http://localhost:8000/'
+
+# index page of each review page of the fixture site, newest first
+NUM_INDEX_PAGES = 3
+FEED_SIZE = 15
+
+
+def copy_site(root, base_url):
+    """ Copy the fixture site to root, with links pointing at base_url """
+    for path in glob.glob(os.path.join(FIXTURE_DIR, '*')):
+        if os.path.isdir(path):
+            shutil.copytree(path, os.path.join(root, os.path.basename(path)))
+        else:
+            shutil.copy(path, root)
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(dirpath, name)
+            with open(path, 'rb') as f:
+                text = f.read()
+            with open(path, 'wb') as f:
+                f.write(text.replace(FIXTURE_URL, base_url.encode('ascii')))
+
+
+def expected_rows(root, base_url):
+    """ Data file lines of the reviews of the site, in index page order """
+    from lxml import html
+    rows = []
+    for page in range(1, NUM_INDEX_PAGES + 1):
+        name = 'index.html' if page == 1 else os.path.join('page', str(page), 'index.html')
+        with open(os.path.join(root, name), 'rb') as f:
+            links = html.fromstring(f.read()).xpath('//a[@class="post-thumb img fix"]/@href')
+        for url in links:
+            path = os.path.join(root, url[len(base_url):], 'index.html')
+            with open(path, 'rb') as f:
+                review, _ = amg_scrape.parse_review_page(f.read(), url)
+            if review is not None:
+                rows.append(review.csv().encode('utf-8') + '\n')
+    return rows
+
+
+def read_rows(fname):
+    with open(fname, 'r') as f:
+        return f.readlines()
+
+
+@contextlib.contextmanager
+def run_dir(parent, name):
+    """ Run in a new directory, where the scraper writes its data file,
+        checkpoint and log """
+    path = os.path.join(parent, name)
+    os.mkdir(path)
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield path
+    finally:
+        os.chdir(cwd)
+
+
+@contextlib.contextmanager
+def page_fetches(base_url):
+    """ Collect the urls of the review pages the scraper fetches, leaving
+        out the index pages, sitemaps and feed """
+    urls = []
+    fetch = amg_scrape.fetch
+
+    def spy(url, *args, **kwargs):
+        path = url[len(base_url):]
+        if path != '' and not path.startswith(('page/', 'feed/')) and \
+                not path.endswith('.xml'):
+            urls.append(url)
+        return fetch(url, *args, **kwargs)
+
+    amg_scrape.fetch = spy
+    try:
+        yield urls
+    finally:
+        amg_scrape.fetch = fetch
+
+
+def data_file():
+    names = [_ for _ in glob.glob('data_*.txt')]
+    return names[0] if len(names) == 1 else None
+
+
+class Checks(object):
+    def __init__(self):
+        self.failures = 0
+
+    def check(self, name, got, expected):
+        if got == expected:
+            print('PASS {}'.format(name))
+        else:
+            self.failures += 1
+            print('FAIL {}: {} rows, expected {}'.format(name, len(got), len(expected)))
+            for row in set(expected) - set(got):
+                print('  missing: {}'.format(row.rstrip()))
+            for row in set(got) - set(expected):
+                print('  unexpected: {}'.format(row.rstrip()))
+
+    def check_no_fetches(self, name, urls):
+        if not urls:
+            print('PASS {}'.format(name))
+        else:
+            self.failures += 1
+            print('FAIL {}: fetched {} pages'.format(name, len(urls)))
+            for url in sorted(set(urls)):
+                print('  fetched: {}'.format(url))
+
+
+def main():
+    tmp_dir = tempfile.mkdtemp()
+    site_dir = os.path.join(tmp_dir, 'site')
+    os.mkdir(site_dir)
+    server = fake_site.start(site_dir, 0)
+    base_url = 'http://localhost:{}/'.format(server.server_address[1])
+    copy_site(site_dir, base_url)
+    expected = expected_rows(site_dir, base_url)
+    checks = Checks()
+    quiet = dict(baseurl=base_url, max_retries=6)
+
+    try:
+        with run_dir(tmp_dir, 'full'):
+            amg_scrape.update(max_page=NUM_INDEX_PAGES, concurrency=4, **quiet)
+            checks.check('full', read_rows(data_file()), expected)
+
+        with run_dir(tmp_dir, 'faults'):
+            fake_site.FakeSiteHandler.latency = 0.01
+            fake_site.FakeSiteHandler.error_rate = 0.1
+            fake_site.FakeSiteHandler.max_inflight = 3
+            try:
+                amg_scrape.update(max_page=NUM_INDEX_PAGES, concurrency=6, **quiet)
+            finally:
+                fake_site.FakeSiteHandler.latency = 0.
+                fake_site.FakeSiteHandler.error_rate = 0.
+                fake_site.FakeSiteHandler.max_inflight = None
+            checks.check('faults', read_rows(data_file()), expected)
+
+        with run_dir(tmp_dir, 'update'):
+            # a data file from before the three newest reviews
+            with open('data.txt', 'w') as f:
+                f.writelines(expected[3:])
+            amg_scrape.update('data.txt', max_page=NUM_INDEX_PAGES, **quiet)
+            checks.check('update', read_rows('data.txt'), expected[3:] + expected[:3])
+            amg_scrape.update('data.txt', max_page=NUM_INDEX_PAGES, **quiet)
+            checks.check('update again', read_rows('data.txt'), expected[3:] + expected[:3])
+
+        with run_dir(tmp_dir, 'sitemap'):
+            amg_scrape.update(discovery='sitemap', **quiet)
+            checks.check('sitemap', read_rows(data_file()), expected)
+            with page_fetches(base_url) as urls:
+                amg_scrape.update(data_file(), discovery='sitemap', **quiet)
+            checks.check('sitemap again', read_rows(data_file()), expected)
+            checks.check_no_fetches('sitemap again fetches', urls)
+
+        with run_dir(tmp_dir, 'feed'):
+            amg_scrape.update(discovery='feed', **quiet)
+            checks.check('feed', read_rows(data_file()), expected[:FEED_SIZE])
+            with page_fetches(base_url) as urls:
+                amg_scrape.update(data_file(), discovery='feed', **quiet)
+            checks.check('feed again', read_rows(data_file()), expected[:FEED_SIZE])
+            checks.check_no_fetches('feed again fetches', urls)
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(tmp_dir)
+
+    print('{} checks failed'.format(checks.failures) if checks.failures else 'all checks passed')
+    return 1 if checks.failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+# Discover review URLs from WordPress sitemaps and RSS feeds instead of
+# paginated index pages. Documents are parsed incrementally with iterparse
+# and yield (url, last modified time) pairs, times in seconds since the
+# epoch or None if unknown.
+
+import calendar
+import email.utils
+import re
+from collections import deque
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
+
+from lxml import etree
+
+SITEMAP_NS = '{http://www.sitemaps.org/schemas/sitemap/0.9}'
+
+_re_w3c_time = re.compile(
+    r'(\d{4})-(\d\d)-(\d\d)(?:T(\d\d):(\d\d)(?::(\d\d))?(?:\.\d+)?)?'
+    r'(Z|[+-]\d\d:?\d\d)?\s*\Z')
+
+
+def parse_w3c_time(text):
+    """ Seconds since the epoch of a sitemap lastmod value, or None """
+    match = _re_w3c_time.match(text.strip()) if text else None
+    if match is None:
+        return None
+    fields = [int(_ or 0) for _ in match.groups()[:6]]
+    seconds = calendar.timegm(fields + [0, 0, 0])
+    tz = match.group(7)
+    if tz not in (None, 'Z'):
+        sign = 1 if tz[0] == '+' else -1
+        tz = tz[1:].replace(':', '')
+        seconds -= sign * (int(tz[:2]) * 3600 + int(tz[2:]) * 60)
+    return seconds
+
+def parse_rfc822_time(text):
+    """ Seconds since the epoch of an RSS pubDate value, or None """
+    parsed = email.utils.parsedate_tz(text) if text else None
+    if parsed is None:
+        return None
+    return email.utils.mktime_tz(parsed)
+
+
+def _iter_elements(body, tag):
+    """ Incrementally parse an XML document, yielding the elements with the
+        given tag and freeing them once processed """
+    for event, elem in etree.iterparse(BytesIO(body), events=('end',), tag=tag):
+        yield elem
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+
+def prefetch(func, args, ahead=2):
+    """ Yield func(arg) for each arg in order, computing up to ahead results
+        in background threads before they are needed """
+    pool = ThreadPool(ahead)
+    pending = deque()
+    try:
+        for arg in args:
+            pending.append(pool.apply_async(func, (arg,)))
+            if len(pending) > ahead:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+
+
+def parse_sitemap(body):
+    """ Split a sitemap document into child sitemaps, for a sitemap index,
+        and page entries. Returns two lists of (url, lastmod) pairs. """
+    sitemaps = []
+    pages = []
+    for elem in _iter_elements(body, (SITEMAP_NS + 'sitemap', SITEMAP_NS + 'url')):
+        loc = elem.findtext(SITEMAP_NS + 'loc')
+        if loc is None:
+            continue
+        entry = (loc.strip(), parse_w3c_time(elem.findtext(SITEMAP_NS + 'lastmod')))
+        if elem.tag == SITEMAP_NS + 'sitemap':
+            sitemaps.append(entry)
+        else:
+            pages.append(entry)
+    return sitemaps, pages
+
+
+def iter_sitemap(fetch, url, accept=None, ahead=2):
+    """
+    Yield (url, lastmod) of the pages listed in the sitemap at url, following
+    sitemap indexes. fetch(url) returns a document body. Child sitemaps are
+    fetched ahead in background threads. If accept is given, only child
+    sitemaps whose url it accepts are followed.
+    """
+    return _iter_sitemap_body(fetch, fetch(url), accept, ahead)
+
+def _iter_sitemap_body(fetch, body, accept, ahead):
+    sitemaps, pages = parse_sitemap(body)
+    for page in pages:
+        yield page
+
+    children = [loc for loc, lastmod in sitemaps if accept is None or accept(loc)]
+    for child_body in prefetch(fetch, children, ahead):
+        for page in _iter_sitemap_body(fetch, child_body, accept, ahead):
+            yield page
+
+
+def parse_feed(body):
+    """ Return (link, pubDate) of the items of an RSS feed document """
+    items = []
+    for elem in _iter_elements(body, 'item'):
+        link = elem.findtext('link')
+        if link is not None:
+            items.append((link.strip(), parse_rfc822_time(elem.findtext('pubDate'))))
+    return items
+
+
+def iter_feed(fetch, url, ahead=2):
+    """ Yield (link, pubDate) of the items of an RSS feed, following its
+        pages (?paged=N) until a page is missing, empty or repeats """
+    def pages():
+        n = 1
+        while True:
+            yield url if n == 1 else '{}?paged={}'.format(url, n)
+            n += 1
+
+    def fetch_items(page_url):
+        try:
+            return parse_feed(fetch(page_url))
+        except (IOError, etree.XMLSyntaxError):
+            return []
+
+    seen = set()
+    for items in prefetch(fetch_items, pages(), ahead):
+        new_items = [_ for _ in items if _[0] not in seen]
+        if not new_items:
+            break
+        for item in new_items:
+            seen.add(item[0])
+            yield item
@@ -0,0 +1,152 @@
+# Local stand-in for the AMG site, serving saved pages from a directory.
+#
+# Lay out the directory like the site: index pages at index.html and
+# page/N/index.html, review pages at <slug>/index.html, the sitemap at
+# wp-sitemap.xml and the feed at feed/index.html, with links pointing at
+# the stand-in. fixtures/site is a small such site for port 8000:
+#
+#   python fake_site.py fixtures/site 8000
+#   python amg_scrape.py --base-url http://localhost:8000/ --max-page 3
+#
+# check_scrape.py runs the scraper against it in every discovery mode.
+#
+# To test the scraper under throttling the stand-in can add latency, fail a
+# fraction of requests with 500s and answer 429 to requests beyond a number
+# in flight:
+#
+#   python fake_site.py saved_pages 8000 --latency 0.2 --error-rate 0.05 --max-inflight 4
+
+import argparse
+import email.utils
+import os
+import random
+import threading
+import time
+from BaseHTTPServer import HTTPServer
+from SimpleHTTPServer import SimpleHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+
+class FakeSiteServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeSiteHandler(SimpleHTTPRequestHandler):
+    """ Serves files like SimpleHTTPRequestHandler, with an ETag based on
+        the file modification time, answering conditional GETs with 304.
+
+        Responses are delayed by latency seconds on average, longer the more
+        requests are in flight. A fraction error_rate of requests fails with
+        a 500, and requests beyond max_inflight get a 429. """
+    root = None # directory served, the working directory if None
+    latency = 0.
+    error_rate = 0.
+    max_inflight = None
+
+    _inflight = 0
+    _inflight_lock = threading.Lock()
+
+    def translate_path(self, path):
+        path = SimpleHTTPRequestHandler.translate_path(self, path)
+        if self.root is None:
+            return path
+        return os.path.join(self.root, os.path.relpath(path, os.getcwd()))
+
+    def _file_etag(self):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            path = os.path.join(path, 'index.html')
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None, None
+        return '"{:x}-{:x}"'.format(int(stat.st_mtime), stat.st_size), int(stat.st_mtime)
+
+    def do_GET(self):
+        cls = FakeSiteHandler
+        with cls._inflight_lock:
+            cls._inflight += 1
+            inflight = cls._inflight
+        try:
+            self._faulty_get(inflight)
+        finally:
+            with cls._inflight_lock:
+                cls._inflight -= 1
+
+    def _faulty_get(self, inflight):
+        if self.max_inflight is not None and inflight > self.max_inflight:
+            self._etag = None
+            self.send_response(429)
+            self.send_header('Retry-After', '1')
+            self.end_headers()
+            return
+        if self.latency > 0.:
+            slowdown = max(1., inflight / float(self.max_inflight or inflight))
+            time.sleep(random.expovariate(1. / self.latency) * slowdown)
+        if random.random() < self.error_rate:
+            self._etag = None
+            self.send_error(500)
+            return
+        self._conditional_get()
+
+    def _conditional_get(self):
+        self._etag, mtime = self._file_etag()
+        if self._etag is not None:
+            since = self.headers.get('If-Modified-Since')
+            since = email.utils.parsedate_tz(since) if since else None
+            if self.headers.get('If-None-Match') == self._etag or \
+                    (since is not None and email.utils.mktime_tz(since) >= mtime):
+                self.send_response(304)
+                self.end_headers()
+                return
+        SimpleHTTPRequestHandler.do_GET(self)
+
+    def end_headers(self):
+        if getattr(self, '_etag', None) is not None:
+            self.send_header('ETag', self._etag)
+        SimpleHTTPRequestHandler.end_headers(self)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(root, port=8000, latency=0., error_rate=0., max_inflight=None):
+    """ Serve the saved pages under root on localhost from a background
+        thread, returning the server. Port 0 picks a free port, see
+        server.server_address. """
+    FakeSiteHandler.root = os.path.abspath(root)
+    FakeSiteHandler.latency = latency
+    FakeSiteHandler.error_rate = error_rate
+    FakeSiteHandler.max_inflight = max_inflight
+    server = FakeSiteServer(('localhost', port), FakeSiteHandler)
+    thread = threading.Thread(target=server.serve_forever, name='fake_site')
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def serve(root, port=8000, latency=0., error_rate=0., max_inflight=None):
+    """ Serve the saved pages under root on localhost until interrupted """
+    server = start(root, port, latency, error_rate, max_inflight)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve saved AMG pages')
+    parser.add_argument('root', help='directory of saved pages')
+    parser.add_argument('port', type=int, nargs='?', default=8000)
+    parser.add_argument('--latency', type=float, default=0.,
+                        help='mean seconds added to each response')
+    parser.add_argument('--error-rate', type=float, default=0.,
+                        help='fraction of requests answered with a 500')
+    parser.add_argument('--max-inflight', type=int, default=None,
+                        help='requests in flight above which 429 is returned')
+    args = parser.parse_args()
+    serve(args.root, args.port, args.latency, args.error_rate, args.max_inflight)
@@ -0,0 +1,340 @@
+# Keep the scraper fetching as fast as the site allows without getting
+# blocked. Failed requests are retried with exponential backoff and jitter,
+# within a retry budget. The number of requests in flight adapts AIMD-style
+# to latency and to throttling or server errors, and a circuit breaker stops
+# all fetching while the site keeps failing. URLs that still fail go to a
+# retry queue file for a later run.
+
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+
+# statuses worth retrying; 429 and 503 mean the site wants us to slow down
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+THROTTLE_STATUSES = (429, 503)
+
+
+class FetchFailed(IOError):
+    ''' Raised when a URL could not be fetched, after any retries '''
+    pass
+
+
+class CircuitOpen(FetchFailed):
+    ''' Raised without trying the network while the circuit breaker is open '''
+    pass
+
+
+def backoff_delay(attempt, base=0.5, cap=30.):
+    """ Seconds to wait before retry number attempt (from 0): exponential
+        backoff with full jitter, uniform in [0, min(cap, base * 2^attempt)] """
+    return random.uniform(0., min(cap, base * 2 ** attempt))
+
+
+def _retry_after(response):
+    """ Seconds asked for by a Retry-After header, if given in seconds """
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryBudget(object):
+    """
+    Token bucket limiting retries to a fraction of requests, so that retries
+    do not multiply the load on a struggling site. Every first attempt adds
+    ratio tokens, every retry takes one, and up to minimum tokens are kept
+    so that a few retries are always possible.
+    """
+    def __init__(self, ratio=0.2, minimum=10):
+        self._ratio = ratio
+        self._max_tokens = float(minimum)
+        self._tokens = float(minimum)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self._max_tokens, self._tokens + self._ratio)
+
+    def withdraw(self):
+        """ Take a token for a retry, returning False if there is none """
+        with self._lock:
+            if self._tokens < 1.:
+                return False
+            self._tokens -= 1.
+            return True
+
+
+class CircuitBreaker(object):
+    """
+    Opens after threshold consecutive failures, failing requests straight
+    away for reset_timeout seconds. Then a single probe request is let
+    through: success closes the breaker, failure opens it again for twice as
+    long, up to max_timeout.
+    """
+    def __init__(self, threshold=20, reset_timeout=30., max_timeout=300.):
+        self._threshold = threshold
+        self._base_timeout = reset_timeout
+        self._max_timeout = max_timeout
+        self._timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened = None # time the breaker opened, None while closed
+        self._probing = False
+        self.trips = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened is None:
+                return 'closed'
+            if time.time() - self._opened < self._timeout:
+                return 'open'
+            return 'half-open'
+
+    def allow(self):
+        """ Whether a request may go ahead now """
+        with self._lock:
+            if self._opened is None:
+                return True
+            if time.time() - self._opened < self._timeout or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened = None
+            self._probing = False
+            self._timeout = self._base_timeout
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing:
+                # the probe failed, wait longer this time
+                self._probing = False
+                self._opened = time.time()
+                self._timeout = min(self._max_timeout, self._timeout * 2)
+                self.trips += 1
+            elif self._opened is None and self._failures >= self._threshold:
+                self._opened = time.time()
+                self.trips += 1
+
+
+class AIMDLimiter(object):
+    """
+    Limits the number of requests in flight. The limit grows by one for
+    every limit requests that complete fine (additive increase) and is
+    halved when requests are throttled, fail, or take longer than the
+    latency target (multiplicative decrease), at most once per round trip.
+    If no target is given it is latency_factor times the lowest latency
+    seen, but at least latency_floor seconds.
+    """
+    def __init__(self, maximum, minimum=1, initial=None, latency_target=None,
+                 latency_factor=4., latency_floor=0.25):
+        self._max = float(maximum)
+        self._min = float(minimum)
+        self.limit = float(maximum if initial is None else initial)
+        self._latency_target = latency_target
+        self._latency_factor = latency_factor
+        self._latency_floor = latency_floor
+        self._min_latency = None
+        self._srtt = None
+        self._last_decrease = 0.
+        self._inflight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self._inflight >= int(self.limit):
+                self._cond.wait()
+            self._inflight += 1
+
+    def release(self, latency=None, congested=False):
+        """ Free a slot, adapting the limit to how the request went """
+        with self._cond:
+            self._inflight -= 1
+            if latency is not None:
+                self._srtt = latency if self._srtt is None else \
+                    0.875 * self._srtt + 0.125 * latency
+                if self._min_latency is None or latency < self._min_latency:
+                    self._min_latency = latency
+                target = self._latency_target
+                if target is None:
+                    target = max(self._latency_floor,
+                                 self._latency_factor * self._min_latency)
+                congested = congested or latency > target
+
+            now = time.time()
+            if congested:
+                # requests in flight when the site slowed down report it
+                # too, so only react once per round trip
+                if now - self._last_decrease > (self._srtt or 0.):
+                    self.limit = max(self._min, self.limit / 2.)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self._max, self.limit + 1. / self.limit)
+            self._cond.notify_all()
+
+    @property
+    def srtt(self):
+        """ Smoothed latency of recent requests in seconds, or None """
+        return self._srtt
+
+
+class FetchController(object):
+    """
+    Sends requests through an AIMD concurrency limit, a circuit breaker and
+    a retry budget. Connection errors, timeouts and the statuses in
+    RETRY_STATUSES are retried up to max_retries times with exponential
+    backoff and jitter, waiting at least as long as a Retry-After header
+    asks. Timeouts adapt to the observed latency, up to the timeout given
+    for each request.
+    """
+    def __init__(self, max_concurrency=4, max_retries=4, backoff_base=0.5,
+                 backoff_cap=30., retry_ratio=0.2, latency_target=None,
+                 failure_threshold=20, reset_timeout=30., min_timeout=2.):
+        self.limiter = AIMDLimiter(max_concurrency, latency_target=latency_target)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.budget = RetryBudget(retry_ratio)
+        self._max_retries = max_retries
+        self._backoff_base = backoff_base
+        self._backoff_cap = backoff_cap
+        self._min_timeout = min_timeout
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.errors = 0
+        self.failed = 0
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _timeout(self, attempt, timeout):
+        """ Four times the smoothed latency, doubled for each retry, between
+            min_timeout and timeout """
+        srtt = self.limiter.srtt
+        if srtt is None or timeout is None:
+            return timeout
+        adaptive = max(self._min_timeout, 4. * srtt) * 2 ** attempt
+        return min(timeout, adaptive)
+
+    def get(self, url, send, headers=None, timeout=None):
+        """ Response of send(url, headers=..., timeout=...), which works like
+            requests.get, retrying failures. Raises FetchFailed when the
+            retries or the retry budget run out, or the breaker is open. """
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self._count('failed')
+                raise CircuitOpen('Circuit open, not fetching {}'.format(url))
+
+            self.limiter.acquire()
+            self._count('requests')
+            response = None
+            error = None
+            try:
+                response = send(url, headers=headers,
+                                timeout=self._timeout(attempt, timeout))
+            except requests.RequestException as e:
+                error = e
+
+            if error is None and response.status_code not in RETRY_STATUSES:
+                self.limiter.release(response.elapsed.total_seconds())
+                self.breaker.success()
+                return response
+
+            self.limiter.release(congested=True)
+            self.breaker.failure()
+            if error is None:
+                self._count('throttled' if response.status_code in THROTTLE_STATUSES
+                            else 'errors')
+                reason = 'HTTP {}'.format(response.status_code)
+            else:
+                self._count('errors')
+                reason = '{}: {}'.format(type(error).__name__, error)
+
+            if attempt >= self._max_retries or not self.budget.withdraw():
+                self._count('failed')
+                raise FetchFailed('{} after {} attempts: {}'.format(
+                    reason, attempt + 1, url))
+
+            delay = backoff_delay(attempt, self._backoff_base, self._backoff_cap)
+            if response is not None:
+                delay = max(delay, min(self._backoff_cap, _retry_after(response) or 0.))
+            time.sleep(delay)
+            attempt += 1
+            self._count('retries')
+
+    def __repr__(self):
+        return ('requests {} retries {} throttled {} errors {} failed {} '
+                'concurrency {:.1f} breaker {} ({} trips)').format(
+            self.requests, self.retries, self.throttled, self.errors,
+            self.failed, self.limiter.limit, self.breaker.state,
+            self.breaker.trips)
+
+
+class RetryQueue(object):
+    """
+    URLs that could not be fetched, kept in a JSON lines file of [url,
+    reason, time] entries so that a later run can try them again.
+    """
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        try:
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        url, reason, when = json.loads(line)
+                    except ValueError:
+                        # partly written last line of an interrupted run
+                        continue
+                    self._entries[url] = (reason, when)
+        except IOError:
+            pass
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, url):
+        return url in self._entries
+
+    def urls(self):
+        return list(self._entries)
+
+    def add(self, url, reason):
+        """ Queue url, appending it to the file straight away """
+        entry = [url, reason, time.time()]
+        with self._lock:
+            self._entries[url] = tuple(entry[1:])
+            with open(self._path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+
+    def remove(self, url):
+        """ Take url off the queue. The file is updated by save(). """
+        with self._lock:
+            self._entries.pop(url, None)
+
+    def save(self):
+        """ Rewrite the file with the queued URLs, removing it if none are
+            left """
+        with self._lock:
+            if not self._entries:
+                if os.path.exists(self._path):
+                    os.remove(self._path)
+                return
+            tmp_name = self._path + '.tmp'
+            with open(tmp_name, 'w') as f:
+                for url, (reason, when) in self._entries.items():
+                    f.write(json.dumps([url, reason, when]) + '\n')
+            os.rename(tmp_name, self._path)
@@ -0,0 +1,189 @@
+# On-disk cache of HTTP responses for the scraper.
+#
+# Bodies are stored content-addressed under objects/, named by their SHA-1,
+# so pages with identical content are stored once. index.json maps each URL
+# to its body and validators (ETag, Last-Modified), in least recently used
+# order.
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheMiss(IOError):
+    ''' Raised in offline mode for URLs that are not in the cache '''
+    pass
+
+
+class ResponseCache(object):
+    """
+    Cache of page bodies keyed by URL. Entries younger than ttl seconds are
+    served without touching the network, older ones are revalidated with a
+    conditional GET. The total size of stored bodies is kept under
+    max_bytes by evicting least recently used entries. In offline mode only
+    cached bodies are served.
+    """
+    def __init__(self, path, ttl=3600., max_bytes=1 << 30, offline=False):
+        self._path = path
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._offline = offline
+        self._lock = threading.Lock()
+        self._index = OrderedDict()
+        self._refs = {} # body hash -> number of urls using it
+        self._size = 0
+        self._dirty = 0
+
+        if not os.path.isdir(self._object_dir()):
+            os.makedirs(self._object_dir())
+        try:
+            with open(self._index_path(), 'r') as f:
+                for url, entry in json.load(f):
+                    self._index[url] = entry
+        except (IOError, ValueError):
+            pass
+
+        for entry in self._index.values():
+            self._refs[entry['sha1']] = self._refs.get(entry['sha1'], 0) + 1
+        self._size = sum(self._object_size(_) for _ in self._refs)
+
+    def _index_path(self):
+        return os.path.join(self._path, 'index.json')
+
+    def _object_dir(self):
+        return os.path.join(self._path, 'objects')
+
+    def _object_path(self, body_hash):
+        return os.path.join(self._object_dir(), body_hash)
+
+    def _object_size(self, body_hash):
+        try:
+            return os.path.getsize(self._object_path(body_hash))
+        except OSError:
+            return 0
+
+    def __len__(self):
+        return len(self._index)
+
+    @property
+    def size(self):
+        """ Total bytes of stored bodies """
+        return self._size
+
+    def _read(self, entry):
+        try:
+            with open(self._object_path(entry['sha1']), 'rb') as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def _lookup(self, url):
+        """ Cache entry of url and its body, marking it most recently used """
+        with self._lock:
+            entry = self._index.pop(url, None)
+            if entry is None:
+                return None, None
+            self._index[url] = entry
+        body = self._read(entry)
+        if body is None:
+            # body went missing from disk
+            with self._lock:
+                if self._index.pop(url, None) is not None:
+                    self._release(entry['sha1'])
+            return None, None
+        return entry, body
+
+    def _store(self, url, response, body=None):
+        """ Record a 200 response, or a 304 response revalidating body """
+        headers = response.headers
+        entry = {'fetched': time.time(),
+                 'etag': headers.get('ETag'),
+                 'last_modified': headers.get('Last-Modified')}
+
+        if body is None:
+            body = response.content
+        entry['sha1'] = hashlib.sha1(body).hexdigest()
+
+        with self._lock:
+            if self._refs.get(entry['sha1'], 0) == 0:
+                object_path = self._object_path(entry['sha1'])
+                if not os.path.exists(object_path):
+                    with open(object_path + '.tmp', 'wb') as f:
+                        f.write(body)
+                    os.rename(object_path + '.tmp', object_path)
+                self._size += len(body)
+            self._refs[entry['sha1']] = self._refs.get(entry['sha1'], 0) + 1
+
+            old = self._index.pop(url, None)
+            if old is not None:
+                # a 304 response need not repeat the validators
+                entry['etag'] = entry['etag'] or old.get('etag')
+                entry['last_modified'] = entry['last_modified'] or old.get('last_modified')
+                self._release(old['sha1'])
+            self._index[url] = entry
+
+            self._dirty += 1
+            self._evict()
+            if self._dirty >= 100:
+                self._save()
+        return body
+
+    def _release(self, body_hash):
+        """ Drop one reference to a body, deleting it when unused. Must hold
+            the lock. """
+        self._refs[body_hash] -= 1
+        if self._refs[body_hash] > 0:
+            return
+        del self._refs[body_hash]
+        self._size -= self._object_size(body_hash)
+        try:
+            os.remove(self._object_path(body_hash))
+        except OSError:
+            pass
+
+    def _evict(self):
+        """ Drop least recently used entries until under the size limit.
+            Must hold the lock. """
+        while self._size > self._max_bytes and len(self._index) > 1:
+            url, entry = self._index.popitem(last=False)
+            self._release(entry['sha1'])
+
+    def _save(self):
+        """ Write the index to disk. Must hold the lock. """
+        tmp_name = self._index_path() + '.tmp'
+        with open(tmp_name, 'w') as f:
+            json.dump(list(self._index.items()), f)
+        os.rename(tmp_name, self._index_path())
+        self._dirty = 0
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def get(self, url, http_get, timeout):
+        """ Body of the page at url, from the cache or fetched with
+            http_get(url, headers=..., timeout=...), which returns a response
+            like requests.get """
+        entry, body = self._lookup(url)
+        if entry is not None:
+            if self._offline or time.time() - entry['fetched'] < self._ttl:
+                return body
+        elif self._offline:
+            raise CacheMiss('{} is not cached'.format(url))
+
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        response = http_get(url, headers=headers, timeout=timeout)
+        if response.status_code == 304 and entry is not None:
+            return self._store(url, response, body)
+        if response.status_code == 200:
+            return self._store(url, response)
+        return response.content
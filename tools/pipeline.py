@@ -0,0 +1,148 @@
+# Helpers to run the scraper as a pipeline of stages connected by bounded
+# queues, so network waits, parsing and writing overlap while memory stays
+# flat.
+
+import os
+import threading
+import time
+from Queue import Queue
+
+# Passed down a queue after the last item
+DONE = object()
+
+
+class StageMetrics(object):
+    """ Throughput and input queue depth of one pipeline stage """
+    def __init__(self, name, queue=None):
+        self.name = name
+        self._queue = queue
+        self._lock = threading.Lock()
+        self.items = 0
+        self.busy = 0. # seconds spent processing, summed over workers
+        self.start = time.time()
+        self.end = None
+        self._depth_sum = 0
+        self._depth_samples = 0
+        self.max_depth = 0
+        self.errors = [] # exceptions raised by the stage function
+
+    def sample_queue(self):
+        if self._queue is None:
+            return
+        depth = self._queue.qsize()
+        with self._lock:
+            self._depth_sum += depth
+            self._depth_samples += 1
+            self.max_depth = max(self.max_depth, depth)
+
+    def record(self, seconds):
+        with self._lock:
+            self.items += 1
+            self.busy += seconds
+
+    def finish(self):
+        self.end = time.time()
+
+    @property
+    def mean_depth(self):
+        return self._depth_sum / float(max(self._depth_samples, 1))
+
+    @property
+    def rate(self):
+        """ Items per second of wall time """
+        elapsed = (self.end or time.time()) - self.start
+        return self.items / elapsed if elapsed > 0 else 0.
+
+    def __repr__(self):
+        return '{:>8}: {:6d} items {:8.2f}/s busy {:7.2f}s queue mean {:5.1f} max {:3d}'.format(
+            self.name, self.items, self.rate, self.busy, self.mean_depth, self.max_depth)
+
+
+def start_stage(name, func, in_queue, out_queue, workers=1, stop=None):
+    """
+    Start workers threads applying func to the items of in_queue. func
+    returns an iterable of items to put on out_queue. After the last worker
+    sees DONE, DONE is passed on to out_queue. Returns the stage metrics.
+
+    If func raises, the exception is kept in metrics.errors, stop (an Event)
+    is set if given, and the stage drops the rest of its input, so that the
+    stages before it are not blocked and DONE still reaches out_queue.
+    """
+    metrics = StageMetrics(name, in_queue)
+    state = {'running': workers}
+    lock = threading.Lock()
+
+    def work():
+        try:
+            while True:
+                metrics.sample_queue()
+                item = in_queue.get()
+                if item is DONE:
+                    # let the other workers of this stage see it too
+                    in_queue.put(DONE)
+                    break
+                if metrics.errors:
+                    continue
+                start = time.time()
+                try:
+                    results = func(item)
+                except Exception as e:
+                    with lock:
+                        metrics.errors.append(e)
+                    if stop is not None:
+                        stop.set()
+                    continue
+                metrics.record(time.time() - start)
+                for result in results:
+                    out_queue.put(result)
+        finally:
+            with lock:
+                state['running'] -= 1
+                last = state['running'] == 0
+            if last:
+                metrics.finish()
+                out_queue.put(DONE)
+
+    for _ in range(workers):
+        thread = threading.Thread(target=work, name=name)
+        thread.daemon = True
+        thread.start()
+    return metrics
+
+
+def bounded_queue(size):
+    return Queue(maxsize=size)
+
+
+class BatchWriter(object):
+    """
+    Buffers lines and writes them to a file in batches of flush_every lines.
+    fsync may be 'never', 'page' (after each end_page) or 'batch' (after
+    every batch written).
+    """
+    def __init__(self, f, flush_every=100, fsync='page'):
+        if fsync not in ('never', 'page', 'batch'):
+            raise ValueError('Unknown fsync policy {!r}'.format(fsync))
+        self._f = f
+        self._flush_every = flush_every
+        self._fsync = fsync
+        self._lines = []
+        self.batches = 0
+
+    def write(self, line):
+        self._lines.append(line)
+        if len(self._lines) >= self._flush_every:
+            self.flush(self._fsync == 'batch')
+
+    def flush(self, sync=False):
+        if self._lines:
+            self._f.write(''.join(self._lines))
+            self._lines = []
+            self.batches += 1
+        self._f.flush()
+        if sync:
+            os.fsync(self._f.fileno())
+
+    def end_page(self):
+        """ Write out everything buffered for the finished page """
+        self.flush(self._fsync != 'never')